@@ -34,11 +34,37 @@
 import os
 import os.path
 import shutil
+import copy
+import re
+import tempfile
+import io
+import uuid
+import threading
+import collections
+import http.server
+import urllib.error
+import urllib.parse
+import urllib.request
 import tarfile
 import hashlib
 import argparse
 import fnmatch
 import sys
+import time
+import json
+import cProfile
+import platform
+import random
+import concurrent.futures
+import zlib
+import bz2
+import bisect
+import stat
+try:
+    import pwd
+    import grp
+except ImportError:
+    pwd = grp = None
 
 STR_EMPTY = ''
 STR_SLASH = '/'
@@ -46,9 +72,18 @@ STR_POINT = '.'
 STR_TAB = '\t'
 STR_EOL = '\n'
 STR_CAT_EXT = '.cat'
+STR_JNL_EXT = '.jnl'
+STR_IDX_EXT = '.idx'
 STR_TAR_EXT = '.tar'
 STR_GZ_EXT = '.tar.gz'
 STR_BZ2_EXT = '.tar.bz2'
+STR_TMP_EXT = '.tmp'
+STR_LOCK_EXT = '.lock'
+STR_PACK = '~'  # separator of packed backup name: [name]~[number]
+
+REPOSITORY_LOCK = 'lock'  # written by prune / compact, create writes [name].lock
+
+VOLUME_FILE_NAME = re.compile(r'^(.+)\.([0-9]+)(\.tar|\.tar\.gz|\.tar\.bz2)$')  # name.volume_number.ext
 
 STR_DIR_LIST = 'DIR_LIST'
 STR_DIR = 'DIR'
@@ -61,19 +96,881 @@ STR_HASH_LIST = 'HASH_LIST'
 STR_HASH = 'HASH'
 STR_HASH_LIST_END = 'HASH_LIST_END'
 
+STR_JOURNAL = 'JOURNAL'
+STR_SOURCE = 'SOURCE'
+STR_TIME = 'TIME'
+STR_FILTER = 'FILTER'
+STR_JOURNAL_END = 'JOURNAL_END'
+
+STR_INDEX = 'INDEX'
+STR_CHUNK = 'CHUNK'
+STR_MEMBER = 'MEMBER'
+STR_INDEX_END = 'INDEX_END'
+
+HASH_BLOCK_SIZE = 64 * 1024  # read size for checksum calculation
+NO_MTIME = -1  # journal: directory is always listed by fast scan
+RACY_MTIME = 2 * 10**9  # ns, directories changed so close to scan time are always listed (FAT: 2 s)
+COPY_BUFFER_SIZE = 1024 * 1024  # download / upload buffer, write buffer of volumes
+SMALL_FILE_SIZE = 256 * 1024  # such files are read once for checksum and archive
+CHUNK_SIZE = 4 * 1024 * 1024  # compressed volumes: new gzip member / bz2 stream after so many tar bytes
+DECOMPRESS_BLOCK_SIZE = 64 * 1024  # compressed bytes decompressed at once
+MULTIPART_SIZE = 8 * 1024 * 1024  # part size of repository writes
+HTTP_TIMEOUT = 300  # s
+
+IOPRIO_CLASS_SHIFT = 13
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_CLASSES = {'best-effort': 2, 'idle': 3}
+# ioprio_set syscall number, Linux only
+IOPRIO_SET_SYSCALL = {'x86_64': 251, 'amd64': 251, 'i386': 289, 'i686': 289, 'aarch64': 30, 'arm64': 30,
+                      'armv7l': 314, 'ppc64le': 273, 'ppc64': 273, 's390x': 282, 'riscv64': 30}
+
+ADAPTIVE_INTERVAL = 1.0  # s, how often I/O pressure is checked
+ADAPTIVE_PRESSURE = 10.0  # %, I/O pressure (some avg10) above which rates are reduced
+ADAPTIVE_MIN_FACTOR = 1.0 / 16
 
-def calc_hash(path):  # IOError
+
+def calc_hash(path, stats=None, throttle=None):  # IOError
     h = hashlib.sha256()
+    size = 0
     
     with open(path, 'rb') as f:  # IOError
-        block = f.read(h.block_size)
+        block = f.read(HASH_BLOCK_SIZE)
         while block:
+            size += len(block)
             h.update(block)
-            block = f.read(h.block_size)
+            if throttle is not None:
+                throttle.read(len(block))
+            block = f.read(HASH_BLOCK_SIZE)
     
+    if stats is not None:
+        stats.count('hash_bytes', size)
     return h.hexdigest()
 
 
+# checksum and data of small file, read by one call
+def read_hash(path, stats=None, throttle=None):  # IOError
+    with open(path, 'rb') as f:  # IOError
+        data = f.read()
+    if throttle is not None:
+        throttle.read(len(data))
+    if stats is not None:
+        stats.count('hash_bytes', len(data))
+    return data, hashlib.sha256(data).hexdigest()
+
+
+class StatsPhase:
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stats.add_time(self.name, time.perf_counter() - self.start)
+        return False
+
+
+# time and number of calls of every phase, counters and per-volume throughput
+class Stats():
+    def __init__(self, command=STR_EMPTY):
+        self.command = command
+        self.start = time.perf_counter()
+        self.phases = {}  # name -> [seconds, calls]
+        self.counters = {}
+        self.volumes = []
+
+    def phase(self, name):
+        return StatsPhase(self, name)
+
+    def add_time(self, name, seconds, calls=1):
+        if name in self.phases:
+            self.phases[name][0] += seconds
+            self.phases[name][1] += calls
+        else:
+            self.phases[name] = [seconds, calls]
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def get(self, name):
+        return self.counters.get(name, 0)
+
+    def seconds(self, name):
+        if name in self.phases:
+            return self.phases[name][0]
+        return 0.0
+
+    def merge(self, other):
+        for name in other.phases:
+            self.add_time(name, other.phases[name][0], other.phases[name][1])
+        for name in other.counters:
+            self.count(name, other.counters[name])
+        self.volumes.extend(other.volumes)
+
+    def add_volume(self, file_name, data_size, file_size, seconds):
+        self.volumes.append({'file': file_name, 'data_bytes': data_size, 'file_bytes': file_size,
+                             'seconds': seconds,
+                             'mb_per_s': data_size/1024.0/1024.0/seconds if seconds > 0 else 0.0})
+
+    def report(self):
+        phases = {}
+        for name in self.phases:
+            phases[name] = {'seconds': self.phases[name][0], 'calls': self.phases[name][1]}
+        # time spent in tar formatting and compression = archiving time without raw reads / writes
+        if 'archive' in self.phases:
+            other = self.seconds('archive') - self.seconds('source_read') - self.seconds('volume_write')
+            phases['compress'] = {'seconds': max(0.0, other), 'calls': self.phases['archive'][1]}
+        if 'extract' in self.phases:
+            other = self.seconds('extract') - self.seconds('volume_read') - self.seconds('destination_write')
+            phases['decompress'] = {'seconds': max(0.0, other), 'calls': self.phases['extract'][1]}
+        return {'command': self.command,
+                'elapsed': time.perf_counter() - self.start,
+                'phases': phases,
+                'counters': dict(self.counters),
+                'bytes_read': self.get('hash_bytes') + self.get('source_read_bytes') +
+                self.get('volume_read_bytes') + self.get('catalog_read_bytes'),
+                'bytes_written': self.get('volume_write_bytes') + self.get('destination_write_bytes') +
+                self.get('catalog_write_bytes'),
+                'volumes': self.volumes}
+
+    def save(self, file_object, stats_format):  # IOError
+        report = self.report()
+        if stats_format == 'json':
+            json.dump(report, file_object, sort_keys=True)
+            file_object.write(STR_EOL)
+            return
+        file_object.write('Command: %s, elapsed: %.03f s%s' % (report['command'], report['elapsed'], STR_EOL))
+        for name in sorted(report['phases']):
+            file_object.write('  %-20s %10.03f s %10d calls%s' % (
+                name, report['phases'][name]['seconds'], report['phases'][name]['calls'], STR_EOL))
+        for name in sorted(report['counters']):
+            file_object.write('  %-20s %10d%s' % (name, report['counters'][name], STR_EOL))
+        file_object.write('  %-20s %10.02f Mb%s' % ('bytes_read', report['bytes_read']/1024.0/1024.0, STR_EOL))
+        file_object.write('  %-20s %10.02f Mb%s' % ('bytes_written', report['bytes_written']/1024.0/1024.0, STR_EOL))
+        for volume in report['volumes']:
+            file_object.write('  %s: %.02f Mb, %.02f Mb/s%s' % (
+                volume['file'], volume['data_bytes']/1024.0/1024.0, volume['mb_per_s'], STR_EOL))
+
+    def save_file(self, stats_format, file_name=None):
+        if file_name is None:
+            self.save(sys.stdout, stats_format)
+            sys.stdout.flush()
+            return
+        try:
+            with open(file_name, mode='w', encoding='utf-8') as file_object:
+                self.save(file_object, stats_format)
+        except IOError:
+            print('ERROR: Can not write statistics file!')
+
+
+# file object wrapper, counts bytes and time of read / write calls as phase `name`
+# time of throttling (if any) is included
+class StatsFile:
+    def __init__(self, file_object, stats, name, throttle=None):
+        self.file = file_object
+        self.stats = stats
+        self.throttle = throttle
+        self.key = name
+        self.key_bytes = name + '_bytes'
+        self.name = getattr(file_object, 'name', STR_EMPTY)
+        self.mode = getattr(file_object, 'mode', STR_EMPTY)
+
+    def read(self, size=-1):  # IOError
+        start = time.perf_counter()
+        data = self.file.read(size)
+        if self.throttle is not None:
+            self.throttle.read(len(data))
+        self.stats.add_time(self.key, time.perf_counter() - start)
+        self.stats.count(self.key_bytes, len(data))
+        return data
+
+    def write(self, data):  # IOError
+        start = time.perf_counter()
+        size = self.file.write(data)
+        if self.throttle is not None:
+            self.throttle.write(len(data))
+        self.stats.add_time(self.key, time.perf_counter() - start)
+        self.stats.count(self.key_bytes, len(data))
+        return size
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        return self.file.seek(offset, whence)
+
+    def tell(self):
+        return self.file.tell()
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+
+# token bucket, rate in bytes per second
+class RateLimiter():
+    def __init__(self, rate):
+        self.rate = float(rate)
+        self.factor = 1.0  # reduced by adaptive mode
+        self.capacity = max(self.rate / 4, float(HASH_BLOCK_SIZE))  # burst: 1/4 s
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+
+    def consume(self, size):
+        # returns time slept
+        now = time.monotonic()
+        rate = self.rate * self.factor
+        self.tokens = min(self.capacity, self.tokens + (now - self.last) * rate)
+        self.last = now
+        self.tokens -= size
+        if self.tokens >= 0:
+            return 0.0
+        delay = -self.tokens / rate
+        time.sleep(delay)
+        return delay
+
+
+def read_io_pressure():
+    # Linux only (PSI): % of time some tasks were stalled on I/O during last 10 s, None if not supported
+    try:
+        with open('/proc/pressure/io') as f:
+            for line in f:
+                fields = line.split()
+                if fields and fields[0] == 'some':
+                    for field in fields[1:]:
+                        if field.startswith('avg10='):
+                            return float(field[len('avg10='):])
+    except (IOError, OSError, ValueError):
+        pass
+    return None
+
+
+# read / write rate limits for source reading and volume writing
+# adaptive mode reduces both rates while I/O pressure of the system is high
+class Throttle():
+    def __init__(self, read_rate=None, write_rate=None, adaptive=False, stats=None):
+        self.stats = stats if stats is not None else Stats()
+        self.read_limiter = RateLimiter(read_rate) if read_rate else None
+        self.write_limiter = RateLimiter(write_rate) if write_rate else None
+        self.adaptive = adaptive
+        self.factor = 1.0
+        self.checked = time.monotonic()
+
+    def _adapt(self):
+        now = time.monotonic()
+        if now - self.checked < ADAPTIVE_INTERVAL:
+            return
+        self.checked = now
+        pressure = read_io_pressure()
+        if pressure is None:
+            return
+        if pressure > ADAPTIVE_PRESSURE:
+            self.factor = max(ADAPTIVE_MIN_FACTOR, self.factor / 2)
+        elif pressure < ADAPTIVE_PRESSURE / 2:
+            self.factor = min(1.0, self.factor * 1.25)
+        for limiter in (self.read_limiter, self.write_limiter):
+            if limiter is not None:
+                limiter.factor = self.factor
+        self.stats.count('throttle_adjustments')
+
+    def read(self, size):
+        if self.read_limiter is not None:
+            if self.adaptive:
+                self._adapt()
+            delay = self.read_limiter.consume(size)
+            if delay > 0:
+                self.stats.add_time('throttle', delay)
+
+    def write(self, size):
+        if self.write_limiter is not None:
+            if self.adaptive:
+                self._adapt()
+            delay = self.write_limiter.consume(size)
+            if delay > 0:
+                self.stats.add_time('throttle', delay)
+
+
+def set_io_priority(io_class):  # OSError
+    # io_class: 'idle', 'best-effort' or 'best-effort:level' (level 0 - 7, 7 is the lowest)
+    name, stub, level = io_class.partition(':')
+    if name not in IOPRIO_CLASSES:
+        raise ValueError(io_class)
+    level = int(level) if level else (0 if name == 'idle' else 7)
+    if not 0 <= level <= 7:
+        raise ValueError(io_class)
+    machine = platform.machine().lower()
+    if (not sys.platform.startswith('linux')) or (machine not in IOPRIO_SET_SYSCALL):
+        raise OSError('I/O priority is not supported on this platform')
+    import ctypes
+    libc = ctypes.CDLL(None, use_errno=True)
+    ioprio = (IOPRIO_CLASSES[name] << IOPRIO_CLASS_SHIFT) | level
+    if libc.syscall(IOPRIO_SET_SYSCALL[machine], IOPRIO_WHO_PROCESS, 0, ioprio) != 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno))
+
+
+def set_priority(nice, io_class):
+    if nice is not None:
+        try:
+            os.nice(nice)
+        except (AttributeError, OSError):
+            print('WARNING: Can not change CPU priority!')
+    if io_class is not None:
+        try:
+            set_io_priority(io_class)
+        except ValueError:
+            print('WARNING: Unknown I/O priority: ' + io_class)
+        except OSError:
+            print('WARNING: Can not change I/O priority!')
+
+
+# ------------------------------------------------------------------------------
+# repository storage
+# files of repository (catalogues, volumes) are addressed by name, without path
+# ------------------------------------------------------------------------------
+
+# repository in local (or network mounted) directory
+class LocalStorage():  # OSError, IOError
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()  # for write_part without os.pwrite
+        self.direct = True  # files are read directly, PooledStorage doesn't copy them
+
+    def full_name(self, name):
+        return self.path + STR_SLASH + name
+
+    def is_valid(self):
+        return os.path.isdir(self.path)
+
+    def exists(self, name):
+        return os.path.isfile(self.full_name(name))
+
+    def size(self, name):  # OSError
+        return os.path.getsize(self.full_name(name))
+
+    def list(self):  # OSError
+        # name -> size
+        result = {}
+        for entry in os.scandir(self.path):  # OSError
+            if entry.is_file():
+                result[entry.name] = entry.stat().st_size
+        return result
+
+    def open_read(self, name):  # IOError
+        return open(self.full_name(name), 'rb')
+
+    def open_write(self, name):  # IOError
+        return open(self.full_name(name), 'wb', buffering=COPY_BUFFER_SIZE)
+    
+    # file object for reading from byte `offset`, `end` - offset after the last needed byte (None - end of file)
+    def open_range(self, name, offset, end=None):  # IOError
+        file_object = open(self.full_name(name), 'rb')  # IOError
+        file_object.seek(offset, os.SEEK_SET)
+        return file_object
+
+    # multipart upload: parts are written to [name].[upload].tmp (in parallel), complete renames it to [name]
+    def write_part(self, name, upload, offset, data):  # OSError
+        fd = os.open(self.full_name(name + STR_POINT + upload + STR_TMP_EXT),
+                     os.O_WRONLY | os.O_CREAT | getattr(os, 'O_BINARY', 0), 0o666)  # OSError
+        try:
+            view = memoryview(data)
+            while len(view) > 0:
+                if hasattr(os, 'pwrite'):
+                    size = os.pwrite(fd, view, offset)  # OSError
+                else:
+                    with self.lock:
+                        os.lseek(fd, offset, os.SEEK_SET)  # OSError
+                        size = os.write(fd, view)  # OSError
+                view = view[size:]
+                offset += size
+        finally:
+            os.close(fd)
+
+    def complete(self, name, upload):  # OSError
+        temp_name = self.full_name(name + STR_POINT + upload + STR_TMP_EXT)
+        with open(temp_name, 'ab') as f:  # OSError
+            os.fsync(f.fileno())
+        os.replace(temp_name, self.full_name(name))  # OSError
+
+    def sync(self, name):  # OSError
+        with open(self.full_name(name), 'r+b') as f:  # OSError
+            os.fsync(f.fileno())
+
+    def remove(self, name):  # OSError
+        os.remove(self.full_name(name))
+
+    def replace(self, source_name, name):  # OSError
+        os.replace(self.full_name(source_name), self.full_name(name))
+
+    def prefetch(self, name):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+# repository on http server (see `serve` command)
+class HttpStorage():  # IOError
+    def __init__(self, url):
+        self.url = url.rstrip(STR_SLASH)
+        self.direct = False
+
+    def _request(self, method, name=STR_EMPTY, query=None, data=None, headers=None):  # IOError
+        url = self.url + STR_SLASH + urllib.parse.quote(name)
+        if query is not None:
+            url += '?' + urllib.parse.urlencode(query)
+        return urllib.request.urlopen(urllib.request.Request(url, data=data, method=method, headers=headers or {}),
+                                      timeout=HTTP_TIMEOUT)  # IOError
+
+    def is_valid(self):
+        try:
+            self.list()
+            return True
+        except (IOError, ValueError):
+            return False
+
+    def exists(self, name):  # IOError
+        try:
+            self._request('HEAD', name).close()
+            return True
+        except urllib.error.HTTPError as e:
+            if e.code == 404:
+                return False
+            raise
+
+    def size(self, name):  # IOError
+        with self._request('HEAD', name) as response:
+            return int(response.headers['Content-Length'])
+
+    def list(self):  # IOError
+        with self._request('GET') as response:
+            return json.loads(response.read().decode('utf-8'))
+
+    def open_read(self, name):  # IOError
+        file_object = tempfile.TemporaryFile()
+        try:
+            with self._request('GET', name) as response:
+                shutil.copyfileobj(response, file_object, COPY_BUFFER_SIZE)
+            file_object.seek(0, os.SEEK_SET)
+        except:
+            file_object.close()
+            raise
+        return file_object
+
+    def open_write(self, name):
+        return MultipartFile(self, name)
+    
+    def open_range(self, name, offset, end=None):  # IOError
+        if end is None:
+            return self._request('GET', name, headers={'Range': 'bytes=%s-' % offset})
+        return self._request('GET', name, headers={'Range': 'bytes=%s-%s' % (offset, max(offset, end - 1))})
+
+    def write_part(self, name, upload, offset, data):  # IOError
+        self._request('PUT', name, {'upload': upload, 'offset': offset}, data).close()
+
+    def complete(self, name, upload):  # IOError
+        self._request('POST', name, {'upload': upload, 'complete': 1}, b'').close()
+
+    def sync(self, name):
+        pass  # server syncs file on complete
+
+    def remove(self, name):  # IOError
+        self._request('DELETE', name).close()
+
+    def replace(self, source_name, name):  # IOError
+        self._request('POST', name, {'rename': source_name}, b'').close()
+
+    def prefetch(self, name):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+# write-only file object, sends data to storage by parts (in background if pool is PooledStorage)
+class MultipartFile(io.RawIOBase):
+    def __init__(self, storage, name, pool=None):
+        io.RawIOBase.__init__(self)
+        self.storage = storage
+        self.pool = pool
+        self.name = name
+        self.mode = 'wb'
+        self.upload = uuid.uuid4().hex
+        self.buffer = bytearray()
+        self.offset = 0  # offset of buffer in file
+        self.futures = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):  # IOError
+        self.buffer += data
+        if len(self.buffer) >= MULTIPART_SIZE:
+            self._send()
+        return len(data)
+
+    def tell(self):
+        return self.offset + len(self.buffer)
+
+    def _send(self):  # IOError
+        data = bytes(self.buffer)
+        self.buffer = bytearray()
+        if self.pool is None:
+            self.storage.write_part(self.name, self.upload, self.offset, data)
+        else:
+            self.futures.append(self.pool.submit_part(self.name, self.upload, self.offset, data))
+        self.offset += len(data)
+
+    def close(self):  # IOError
+        if self.closed:
+            return
+        io.RawIOBase.close(self)
+        if (len(self.buffer) > 0) or (self.offset == 0):
+            self._send()
+        if self.pool is None:
+            self.storage.complete(self.name, self.upload)
+        else:
+            self.pool.submit_complete(self.name, self.upload, self.futures, self.offset)
+
+
+# thread pool over other storage:
+# - several volume reads / writes are in flight at the same time;
+# - volumes are downloaded to temporary files in background (prefetch), last ones are kept;
+# - writes are sent by parts in background, `flush` waits for them;
+# - list of files is read once.
+class PooledStorage():  # IOError
+    def __init__(self, storage, threads):
+        self.storage = storage
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=threads)
+        self.committer = concurrent.futures.ThreadPoolExecutor(max_workers=1)  # waits for parts, completes uploads
+        self.slots = threading.BoundedSemaphore(threads * 2)  # parts in memory
+        self.lock = threading.Lock()
+        self.listing = None  # name -> size
+        self.cache = collections.OrderedDict()  # name -> future of temporary file name
+        self.cache_size = threads + 1
+        self.writes = {}  # name -> future of completed upload
+        self.temp_dir = tempfile.mkdtemp(prefix='siddar_')
+
+    def _list(self):  # IOError
+        with self.lock:
+            if self.listing is None:
+                self.listing = self.storage.list()
+            return self.listing
+
+    def _wait_write(self, name):  # IOError
+        with self.lock:
+            future = self.writes.get(name)
+        if future is not None:
+            future.result()
+
+    def is_valid(self):
+        return self.storage.is_valid()
+
+    def exists(self, name):  # IOError
+        with self.lock:
+            if name in self.writes:
+                return True
+        return name in self._list()
+
+    def size(self, name):  # IOError
+        self._wait_write(name)
+        listing = self._list()
+        if name in listing:
+            return listing[name]
+        return self.storage.size(name)
+
+    def list(self):  # IOError
+        # listing is read again: files written by other processes (locks) are visible
+        self.flush()
+        listing = self.storage.list()  # IOError
+        with self.lock:
+            self.listing = listing
+            return dict(listing)
+
+    def _download(self, name):  # IOError
+        (fd, temp_name) = tempfile.mkstemp(dir=self.temp_dir)
+        try:
+            with os.fdopen(fd, 'wb') as file_object:
+                with self.storage.open_read(name) as source:  # IOError
+                    shutil.copyfileobj(source, file_object, COPY_BUFFER_SIZE)
+        except:
+            os.remove(temp_name)
+            raise
+        return temp_name
+
+    def _fetch(self, name):
+        with self.lock:
+            if name in self.cache:
+                self.cache.move_to_end(name)
+                return self.cache[name]
+            future = self.pool.submit(self._download, name)
+            self.cache[name] = future
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)[1].add_done_callback(remove_download)
+            return future
+
+    def _drop(self, name):
+        with self.lock:
+            if name in self.cache:
+                self.cache.pop(name).add_done_callback(remove_download)
+
+    def prefetch(self, name):
+        if (not self.storage.direct) and (name in self._list()):
+            self._fetch(name)
+
+    def open_read(self, name):  # IOError
+        self._wait_write(name)
+        if self.storage.direct:
+            return self.storage.open_read(name)  # IOError
+        if name not in self._list():
+            raise FileNotFoundError(name)
+        try:
+            return open(self._fetch(name).result(), 'rb')  # IOError
+        except IOError:
+            # failed download or removed from cache: try again
+            self._drop(name)
+            return open(self._fetch(name).result(), 'rb')  # IOError
+
+    def open_write(self, name):
+        self._drop(name)
+        return MultipartFile(self.storage, name, self)
+    
+    # prefetched volume is used if it is in cache, otherwise only requested range is read
+    def open_range(self, name, offset, end=None):  # IOError
+        self._wait_write(name)
+        with self.lock:
+            future = self.cache.get(name)
+        if future is not None:
+            try:
+                file_object = open(future.result(), 'rb')  # IOError
+                file_object.seek(offset, os.SEEK_SET)
+                return file_object
+            except IOError:
+                self._drop(name)
+        return self.storage.open_range(name, offset, end)
+
+    def _write_part(self, name, upload, offset, data):  # IOError
+        try:
+            self.storage.write_part(name, upload, offset, data)
+        finally:
+            self.slots.release()
+
+    def submit_part(self, name, upload, offset, data):
+        self.slots.acquire()
+        return self.pool.submit(self._write_part, name, upload, offset, data)
+
+    def _complete(self, name, upload, futures, size):  # IOError
+        for future in futures:
+            future.result()
+        self.storage.complete(name, upload)
+        with self.lock:
+            if self.listing is not None:
+                self.listing[name] = size
+
+    def submit_complete(self, name, upload, futures, size):
+        with self.lock:
+            self.writes[name] = self.committer.submit(self._complete, name, upload, futures, size)
+
+    def sync(self, name):  # IOError
+        self._wait_write(name)
+        self.storage.sync(name)
+
+    def remove(self, name):  # IOError
+        self._wait_write(name)
+        self._drop(name)
+        self.storage.remove(name)
+        with self.lock:
+            if self.listing is not None:
+                self.listing.pop(name, None)
+
+    def replace(self, source_name, name):  # IOError
+        self._wait_write(source_name)
+        self._drop(source_name)
+        self._drop(name)
+        self.storage.replace(source_name, name)
+        with self.lock:
+            if self.listing is not None:
+                self.listing[name] = self.listing.pop(source_name, 0)
+
+    def flush(self):  # IOError
+        # wait for all writes, raise first error
+        with self.lock:
+            futures = list(self.writes.values())
+        for future in futures:
+            future.result()
+
+    def close(self):  # IOError
+        try:
+            self.flush()
+        finally:
+            self.pool.shutdown(wait=True)
+            self.committer.shutdown(wait=True)
+            shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+
+def remove_download(future):
+    # done callback: remove temporary file of downloaded volume
+    if (not future.cancelled()) and (future.exception() is None):
+        try:
+            os.remove(future.result())
+        except OSError:
+            pass  # still open (Windows)
+
+
+def open_storage(repository, io_threads=0):
+    if repository.startswith('http://') or repository.startswith('https://'):
+        storage = HttpStorage(repository)
+    else:
+        storage = LocalStorage(repository)
+    if io_threads > 0:
+        storage = PooledStorage(storage, io_threads)
+    return storage
+
+
+def open_text(storage, name, mode='r'):  # IOError
+    if mode == 'r':
+        return io.TextIOWrapper(storage.open_read(name), encoding='utf-8')
+    return io.TextIOWrapper(storage.open_write(name), encoding='utf-8')
+
+
+# file name in repository directory ('' - repository itself)
+def valid_file_name(name):
+    return not ((STR_SLASH in name) or ('\\' in name) or (name in (STR_POINT, '..')))
+
+
+# stand-in http server for HttpStorage, serves LocalStorage
+class RepositoryHandler(http.server.BaseHTTPRequestHandler):
+    def _parse(self):
+        # returns (name, query) or None if request is not valid
+        url = urllib.parse.urlsplit(self.path)
+        name = urllib.parse.unquote(url.path[1:])
+        query = dict(urllib.parse.parse_qsl(url.query))
+        if not valid_file_name(name):
+            return None
+        if ('upload' in query) and (re.match('^[0-9a-f]+$', query['upload']) is None):
+            return None
+        if self.server.latency > 0:
+            time.sleep(self.server.latency)
+        return name, query
+
+    def _reply(self, code, data=b''):
+        self.send_response(code)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _body(self):
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def do_HEAD(self):
+        request = self._parse()
+        if request is None:
+            return self._reply(400)
+        try:
+            if not self.server.storage.exists(request[0]):
+                return self._reply(404)
+            size = self.server.storage.size(request[0])
+        except FileNotFoundError:
+            return self._reply(404)  # removed after check
+        except IOError:
+            return self._reply(500)
+        self.send_response(200)
+        self.send_header('Content-Length', str(size))
+        self.end_headers()
+
+    def do_GET(self):
+        request = self._parse()
+        if request is None:
+            return self._reply(400)
+        (name, query) = request
+        try:
+            if name == STR_EMPTY:
+                return self._reply(200, json.dumps(self.server.storage.list()).encode('utf-8'))
+            with self.server.storage.open_read(name) as file_object:
+                size = os.fstat(file_object.fileno()).st_size
+                # only 'bytes=first-' and 'bytes=first-last' ranges
+                m = re.match(r'^bytes=([0-9]+)-([0-9]*)$', self.headers.get('Range', STR_EMPTY))
+                if m is None:
+                    self.send_response(200)
+                    length = size
+                else:
+                    first = min(int(m.group(1)), size)
+                    last = min(int(m.group(2)), size - 1) if m.group(2) else size - 1
+                    length = max(0, last - first + 1)
+                    file_object.seek(first, os.SEEK_SET)
+                    self.send_response(206)
+                    self.send_header('Content-Range', 'bytes %s-%s/%s' % (first, first + length - 1, size))
+                self.send_header('Content-Length', str(length))
+                self.end_headers()
+                try:
+                    while length > 0:
+                        data = file_object.read(min(length, COPY_BUFFER_SIZE))
+                        if not data:
+                            break
+                        self.wfile.write(data)
+                        length -= len(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # client has read enough
+        except IOError:
+            self._reply(404)
+
+    def do_PUT(self):
+        request = self._parse()
+        if (request is None) or ('upload' not in request[1]):
+            return self._reply(400)
+        (name, query) = request
+        try:
+            self.server.storage.write_part(name, query['upload'], int(query.get('offset', 0)), self._body())
+            self._reply(200)
+        except (IOError, ValueError):
+            self._reply(500)
+
+    def do_POST(self):
+        request = self._parse()
+        if request is None:
+            return self._reply(400)
+        (name, query) = request
+        self._body()
+        try:
+            if ('upload' in query) and ('complete' in query):
+                self.server.storage.complete(name, query['upload'])
+            elif 'rename' in query:
+                if (name == STR_EMPTY) or (query['rename'] == STR_EMPTY) or \
+                        (not valid_file_name(query['rename'])):
+                    return self._reply(400)
+                self.server.storage.replace(query['rename'], name)
+            else:
+                return self._reply(400)
+            self._reply(200)
+        except IOError:
+            self._reply(500)
+
+    def do_DELETE(self):
+        request = self._parse()
+        if request is None:
+            return self._reply(400)
+        try:
+            self.server.storage.remove(request[0])
+            self._reply(200)
+        except IOError:
+            self._reply(404)
+
+    def log_message(self, format_string, *args):
+        if self.server.verbose:
+            http.server.BaseHTTPRequestHandler.log_message(self, format_string, *args)
+
+
 class CatalogFormatError(Exception):
     pass
 
@@ -96,14 +993,54 @@ def hash_name(info):  # HashNameError
     return info.hash + '.' + str(info.size)
 
 
+def split_hash_name(tar_name):  # HashNameError
+    # 'sha256.size' -> (sha256, size)
+    (h, stub, size) = tar_name.partition(STR_POINT)
+    if (len(h) != 64) or (not size.isdigit()):
+        raise HashNameError()
+    return h, int(size)
+
+
+# extension of volumes for backup `name` in storage, None if there is no first volume
+def volume_ext(storage, name):  # IOError
+    for ext in (STR_TAR_EXT, STR_GZ_EXT, STR_BZ2_EXT):
+        if storage.exists(name + '.1' + ext):
+            return ext
+    return None
+
+
+# file names of all sequential volumes of backup `name` in storage
+def volume_list(storage, name):  # IOError
+    ext = volume_ext(storage, name)
+    result = []
+    if ext is not None:
+        while storage.exists(name + STR_POINT + str(len(result) + 1) + ext):
+            result.append(name + STR_POINT + str(len(result) + 1) + ext)
+    return result
+
+
 class FileList():  # OSError, IOError, CatalogFormatError
     def __init__(self):
         self.dict = {}
     
-    def _get_dir_list(self, root_dir, rel_dir=STR_EMPTY):  # OSError
+    def _get_dir_list(self, root_dir, rel_dir=STR_EMPTY, journal=None, fast=None):  # OSError
         if rel_dir == STR_EMPTY:
             self.dict.clear()
         current_dir = root_dir + rel_dir
+        if journal is not None:
+            journal.dirs[rel_dir] = os.stat(current_dir).st_mtime_ns  # OSError
+        if (fast is not None) and (fast.journal.dirs.get(rel_dir) == journal.dirs[rel_dir]):
+            # directory is not changed since reference: take files from reference without stat
+            fast.reused_dirs += 1
+            for rel_path in fast.dirs.get(rel_dir, []):
+                path_info = FileInfo(True)
+                path_info.mtime = int(os.path.getmtime(root_dir + rel_path))  # OSError
+                self.dict[rel_path] = path_info
+                self._get_dir_list(root_dir, rel_path, journal, fast)
+            for rel_path in fast.files.get(rel_dir, []):
+                self.dict[rel_path] = copy.copy(fast.reference.dict[rel_path])
+                fast.reused.add(rel_path)
+            return
         current_dir_list = os.listdir(current_dir)  # OSError
         for f in current_dir_list:
             full_path = current_dir + STR_SLASH + f
@@ -112,15 +1049,17 @@ class FileList():  # OSError, IOError, CatalogFormatError
                 path_info = FileInfo(True)
                 path_info.mtime = int(os.path.getmtime(full_path))  # OSError
                 self.dict[rel_path] = path_info
-                self._get_dir_list(root_dir, rel_path)
+                self._get_dir_list(root_dir, rel_path, journal, fast)
             elif os.path.isfile(full_path):  # OSError
                 path_info = FileInfo(False)
                 # read mtime, size and hash directly before file checking / archiving
                 self.dict[rel_path] = path_info
 
-    def read_dir_list(self, source_path):
+    # journal - Journal for directory mtimes of this scan
+    # fast - FastScan: not changed directories are not listed
+    def read_dir_list(self, source_path, journal=None, fast=None):
         try:
-            self._get_dir_list(source_path)
+            self._get_dir_list(source_path, journal=journal, fast=fast)
         except IOError as e:
             print('ERROR: Can not read: ' + e.filename)
             return
@@ -213,90 +1152,116 @@ class FileList():  # OSError, IOError, CatalogFormatError
     
     def load(self, file_object):  # IOError, CatalogFormatError
         # file_object = open('file.name', mode='r', encoding='utf-8')
-        wait_list = 0
-        wait_dir_file = 1
-        wait_path = 2
-        wait_mtime = 3
-        wait_size = 4
-        wait_hash = 5
-        wait_dir_end = 6
-        wait_file_end = 7
-
         self.dict.clear()
         file_object.seek(0, os.SEEK_SET)
+        for (path, info) in dir_list_entries(file_object):  # CatalogFormatError
+            self.dict[path] = info
 
-        state = wait_list
-        info_is_dir = False
-        info_path = STR_EMPTY
-        info_mtime = -1
-        info_size = -1
-        info_hash = STR_EMPTY
-        for s in file_object:
-            line = s.strip()
-            if (state == wait_list) and (line == STR_DIR_LIST):
-                state = wait_dir_file
-            
-            elif ((state == wait_dir_file) and
-                  ((line == STR_DIR) or (line == STR_FILE) or (line == STR_DIR_LIST_END))):
-                if line == STR_DIR:
-                    info_is_dir = True
-                    state = wait_path
-                elif line == STR_FILE:
-                    info_is_dir = False
-                    state = wait_path
-                elif line == STR_DIR_LIST_END:
-                    return
-            
-            elif state == wait_path:
-                info_path = line
-                state = wait_mtime
-            
-            elif state == wait_mtime:
-                info_mtime = int(line)
-                if info_is_dir:
-                    state = wait_dir_end
-                else:
-                    state = wait_size
-            
-            elif state == wait_size:
-                info_size = int(line)
-                state = wait_hash
-            
-            elif state == wait_hash:
-                info_hash = line
-                state = wait_file_end
-            
-            elif (state == wait_dir_end) and (line == STR_DIR_END):
-                self.dict[info_path] = FileInfo(True)
-                self.dict[info_path].mtime = info_mtime
-                info_is_dir = False
-                state = wait_dir_file
-            
-            elif (state == wait_file_end) and (line == STR_FILE_END):
-                self.dict[info_path] = FileInfo(False)
-                self.dict[info_path].mtime = info_mtime
-                self.dict[info_path].size = info_size
-                self.dict[info_path].hash = info_hash
-                state = wait_dir_file
-            
-            else:
-                raise CatalogFormatError()  # CatalogFormatError
-
-    def load_file(self, file_name):
+    # returns False if catalogue is not loaded completely
+    def load_file(self, file_name, stats=None, storage=None):
+        if stats is None:
+            stats = Stats()
         try:
-            file_object = open(file_name, mode='r', encoding='utf-8')
+            if storage is None:
+                file_object = open(file_name, mode='r', encoding='utf-8')
+            else:
+                file_object = open_text(storage, file_name)
             try:
-                self.load(file_object)
+                with stats.phase('catalog_read'):
+                    self.load(file_object)
+                stats.count('catalog_read_bytes', file_object.buffer.tell())
             except IOError:
                 print('ERROR: Can not read reference catalogue file!')
-                return
+                return False
             except CatalogFormatError:
                 print('ERROR: Reference catalogue is damaged!')
-                return
+                return False
             finally:
                 file_object.close()
         except IOError:
             print('ERROR: Can not open reference catalogue file!')
+            return False
+        return True
+
+
+# (path, FileInfo) of DIR_LIST section in order of catalogue (sorted by path)
+# reading stops after DIR_LIST_END: HASH_LIST can be read from the same file object
+# file without DIR_LIST_END (truncated) is damaged
+def dir_list_entries(file_object):  # IOError, CatalogFormatError
+    wait_list = 0
+    wait_dir_file = 1
+    wait_path = 2
+    wait_mtime = 3
+    wait_size = 4
+    wait_hash = 5
+    wait_dir_end = 6
+    wait_file_end = 7
+
+    state = wait_list
+    info_is_dir = False
+    info_path = STR_EMPTY
+    info_mtime = -1
+    info_size = -1
+    info_hash = STR_EMPTY
+    for s in file_object:
+        line = s.strip()
+        if (state == wait_list) and (line == STR_DIR_LIST):
+            state = wait_dir_file
+
+        elif ((state == wait_dir_file) and
+              ((line == STR_DIR) or (line == STR_FILE) or (line == STR_DIR_LIST_END))):
+            if line == STR_DIR:
+                info_is_dir = True
+                state = wait_path
+            elif line == STR_FILE:
+                info_is_dir = False
+                state = wait_path
+            elif line == STR_DIR_LIST_END:
+                return
+
+        elif state == wait_path:
+            info_path = line
+            state = wait_mtime
+
+        elif state == wait_mtime:
+            try:
+                info_mtime = int(line)
+            except ValueError:
+                raise CatalogFormatError()
+            if info_is_dir:
+                state = wait_dir_end
+            else:
+                state = wait_size
+
+        elif state == wait_size:
+            try:
+                info_size = int(line)
+            except ValueError:
+                raise CatalogFormatError()
+            state = wait_hash
+
+        elif state == wait_hash:
+            info_hash = line
+            state = wait_file_end
+
+        elif (state == wait_dir_end) and (line == STR_DIR_END):
+            info = FileInfo(True)
+            info.mtime = info_mtime
+            yield info_path, info
+            info_is_dir = False
+            state = wait_dir_file
+
+        elif (state == wait_file_end) and (line == STR_FILE_END):
+            info = FileInfo(False)
+            info.mtime = info_mtime
+            info.size = info_size
+            info.hash = info_hash
+            yield info_path, info
+            state = wait_dir_file
+
+        else:
+            raise CatalogFormatError()  # CatalogFormatError
+    raise CatalogFormatError()
 
 
 # key = hash + u'.' + unicode(size)
@@ -317,138 +1282,532 @@ class HashList():  # IOError, CatalogFormatError
     
     def load(self, file_object):  # IOError, CatalogFormatError
         # file_object = open('file.name', mode='r', encoding='utf-8')
-        wait_list = 0
-        wait_hash = 1
         self.dict.clear()
         file_object.seek(0, os.SEEK_SET)
+        for (key, archive) in hash_list_entries(file_object):  # CatalogFormatError
+            self.dict[key] = archive
 
-        state = wait_list
-        for s in file_object:
-            line = s.strip()
-            if (state == wait_list) and (line == STR_HASH_LIST):
-                state = wait_hash
-            elif state == wait_hash:
-                if line == STR_HASH_LIST_END:
-                    return
-                else:
-                    lst = line.split(STR_TAB)
-                    if (len(lst) == 3) and (lst[0] == STR_HASH):
-                        self.dict[lst[1]] = lst[2]
-                    else:
-                        raise CatalogFormatError()
-
-    def load_file(self, file_name):
+    # returns False if catalogue is not loaded completely
+    def load_file(self, file_name, stats=None, storage=None):
+        if stats is None:
+            stats = Stats()
         try:
-            file_object = open(file_name, mode='r', encoding='utf-8')
+            if storage is None:
+                file_object = open(file_name, mode='r', encoding='utf-8')
+            else:
+                file_object = open_text(storage, file_name)
             try:
-                self.load(file_object)
+                with stats.phase('catalog_read'):
+                    self.load(file_object)
+                stats.count('catalog_read_bytes', file_object.buffer.tell())
             except IOError:
                 print('ERROR: Can not read reference catalogue file!')
-                return
+                return False
             except CatalogFormatError:
                 print('ERROR: Reference catalogue is damaged!')
-                return
+                return False
             finally:
                 file_object.close()
         except IOError:
             print('ERROR: Can not open reference catalogue file!')
+            return False
+        return True
+
+
+# (sha256.size, archive) of HASH_LIST section in order of catalogue (sorted)
+# file without HASH_LIST_END (truncated) is damaged
+def hash_list_entries(file_object):  # IOError, CatalogFormatError
+    wait_list = 0
+    wait_hash = 1
+    
+    state = wait_list
+    for s in file_object:
+        line = s.strip()
+        if (state == wait_list) and (line == STR_HASH_LIST):
+            state = wait_hash
+        elif state == wait_hash:
+            if line == STR_HASH_LIST_END:
+                return
+            else:
+                lst = line.split(STR_TAB)
+                if (len(lst) == 3) and (lst[0] == STR_HASH):
+                    yield lst[1], lst[2]
+                else:
+                    raise CatalogFormatError()
+    raise CatalogFormatError()
+
+
+# directory mtimes (ns) of source tree at the time of backup: [name].jnl
+class Journal():  # IOError, CatalogFormatError
+    def __init__(self, source=STR_EMPTY, filters=STR_EMPTY):
+        self.source = source  # absolute path of source
+        self.filters = filters  # include / exclude masks, json
+        self.time = time.time_ns()  # scan start
+        self.dirs = {}  # relative path ('' - source itself) -> mtime
+    
+    # journal of other backup can be used for fast scan of this source
+    def matches(self, other):
+        return (self.source == other.source) and (self.filters == other.filters)
+    
+    # forget mtime of directories changed just before scan: their later changes can keep the same mtime
+    def drop_racy(self):
+        for key in self.dirs:
+            if self.dirs[key] >= self.time - RACY_MTIME:
+                self.dirs[key] = NO_MTIME
+    
+    def save(self, file_object):  # IOError
+        file_object.write(STR_JOURNAL + STR_EOL)
+        file_object.write(STR_SOURCE + STR_TAB + self.source + STR_EOL)
+        file_object.write(STR_TIME + STR_TAB + str(self.time) + STR_EOL)
+        file_object.write(STR_FILTER + STR_TAB + self.filters + STR_EOL)
+        for key in sorted(self.dirs):
+            file_object.write(STR_DIR + STR_TAB + str(self.dirs[key]) + STR_TAB + key + STR_EOL)
+        file_object.write(STR_JOURNAL_END + STR_EOL)
+    
+    def load(self, file_object):  # IOError, CatalogFormatError
+        self.dirs.clear()
+        if file_object.readline().rstrip(STR_EOL) != STR_JOURNAL:
+            raise CatalogFormatError()
+        for s in file_object:
+            lst = s.rstrip(STR_EOL).split(STR_TAB, 2)
+            try:
+                if lst[0] == STR_JOURNAL_END:
+                    return
+                elif lst[0] == STR_SOURCE:
+                    self.source = lst[1]
+                elif lst[0] == STR_TIME:
+                    self.time = int(lst[1])
+                elif lst[0] == STR_FILTER:
+                    self.filters = lst[1]
+                elif lst[0] == STR_DIR:
+                    self.dirs[lst[2]] = int(lst[1])
+                else:
+                    raise CatalogFormatError()
+            except (IndexError, ValueError):
+                raise CatalogFormatError()
+        raise CatalogFormatError()
+
+
+# state of fast scan: files of not changed directories are taken from reference
+# subdirectories are taken from journal: reference catalogue has no directories removed by masks
+class FastScan():
+    def __init__(self, reference, journal):
+        self.reference = reference  # FileList
+        self.journal = journal  # Journal of reference
+        self.files = {}  # relative dir path -> relative paths of its files in reference
+        for key in reference.dict:
+            if not reference.dict[key].isDir:
+                self.files.setdefault(key.rpartition(STR_SLASH)[0], []).append(key)
+        self.dirs = {}  # relative dir path -> relative paths of its subdirectories in journal
+        for key in journal.dirs:
+            if key != STR_EMPTY:
+                self.dirs.setdefault(key.rpartition(STR_SLASH)[0], []).append(key)
+        self.reused = set()  # files taken from reference
+        self.reused_dirs = 0
+
+
+# write-only stream of gzip members / bz2 streams, new one is started every CHUNK_SIZE tar bytes,
+# decompression can start at the beginning of any of them; gzip, bzip2 and tar read such files as usual
+class CompressFile():  # IOError
+    def __init__(self, file_object, ext):
+        self.file = file_object
+        self.name = getattr(file_object, 'name', STR_EMPTY)
+        self.ext = ext
+        self.compressor = None
+        self.offset = 0  # tar bytes
+        self.chunk_start = 0
+        self.compressed = 0  # bytes written to file_object
+        self.chunks = []  # (tar offset, file offset) of chunk starts
+    
+    def write(self, data):  # IOError
+        if self.compressor is None:
+            self.chunks.append((self.offset, self.compressed))
+            self.chunk_start = self.offset
+            if self.ext == STR_GZ_EXT:
+                self.compressor = zlib.compressobj(9, zlib.DEFLATED, 31)
+            else:
+                self.compressor = bz2.BZ2Compressor(9)
+        self._write(self.compressor.compress(data))
+        self.offset += len(data)
+        if self.offset - self.chunk_start >= CHUNK_SIZE:
+            self._write(self.compressor.flush())
+            self.compressor = None
+        return len(data)
+    
+    def _write(self, data):  # IOError
+        if data:
+            self.file.write(data)
+            self.compressed += len(data)
+    
+    def tell(self):
+        return self.offset
+    
+    def close(self):  # IOError
+        if self.compressor is not None:
+            self._write(self.compressor.flush())
+            self.compressor = None
+        self.file.close()
+
+
+# read-only stream of decompressed data of file, which can consist of several gzip members / bz2 streams
+# (tarfile stream mode 'r|gz' / 'r|bz2' stops after the first one)
+class DecompressFile():  # IOError
+    def __init__(self, file_object, ext):
+        self.file = file_object
+        self.ext = ext
+        self.decompressor = self._new()
+        self.buffer = b''
+        self.position = 0  # in buffer
+        self.eof = False
+    
+    def _new(self):
+        if self.ext == STR_GZ_EXT:
+            return zlib.decompressobj(31)
+        return bz2.BZ2Decompressor()
+    
+    def _fill(self):  # IOError
+        # replace buffer by next decompressed data, False at the end of file
+        self.buffer = b''
+        self.position = 0
+        while (len(self.buffer) == 0) and (not self.eof):
+            data = self.file.read(DECOMPRESS_BLOCK_SIZE)
+            if not data:
+                self.eof = True
+            result = []
+            while data:
+                try:
+                    result.append(self.decompressor.decompress(data))
+                except (zlib.error, EOFError, ValueError) as e:
+                    raise IOError('Compressed data is damaged: ' + str(e))
+                if self.decompressor.eof:
+                    data = self.decompressor.unused_data
+                    self.decompressor = self._new()
+                else:
+                    data = b''
+            self.buffer = b''.join(result)
+        return len(self.buffer) > 0
+    
+    def read(self, size=-1):  # IOError
+        result = []
+        while (size < 0) or (size > 0):
+            if (self.position >= len(self.buffer)) and (not self._fill()):
+                break
+            if size < 0:
+                result.append(self.buffer[self.position:])
+                self.position = len(self.buffer)
+            else:
+                block = self.buffer[self.position:self.position + size]
+                self.position += len(block)
+                size -= len(block)
+                result.append(block)
+        return b''.join(result)
+    
+    def close(self):
+        self.file.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+# size of file data in tar with padding
+def tar_blocks(size):
+    return ((size + tarfile.BLOCKSIZE - 1) // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+
+
+# tar stream of volume file object (decompressed for .tar.gz / .tar.bz2)
+def volume_stream(file_object, ext):
+    if ext == STR_TAR_EXT:
+        return file_object
+    return DecompressFile(file_object, ext)
+
+
+# positions of objects in volumes of one backup: [name].idx
+# for compressed volumes also positions of chunks (see CompressFile)
+class VolumeIndex():  # IOError, CatalogFormatError
+    def __init__(self):
+        self.members = {}  # sha256.size -> [(volume number, tar offset of data, size)] - pieces of object
+        self.chunks = {}  # volume number -> [(tar offset, file offset)], no record: not compressed
+    
+    def add_member(self, volume, offset, size, name):
+        self.members.setdefault(name, []).append((volume, offset, size))
+    
+    def save(self, file_object):  # IOError
+        file_object.write(STR_INDEX + STR_EOL)
+        for volume in sorted(self.chunks):
+            for (offset, file_offset) in self.chunks[volume]:
+                file_object.write(STR_CHUNK + STR_TAB + str(volume) + STR_TAB + str(offset) + STR_TAB +
+                                  str(file_offset) + STR_EOL)
+        for name in sorted(self.members):
+            for (volume, offset, size) in self.members[name]:
+                file_object.write(STR_MEMBER + STR_TAB + str(volume) + STR_TAB + str(offset) + STR_TAB +
+                                  str(size) + STR_TAB + name + STR_EOL)
+        file_object.write(STR_INDEX_END + STR_EOL)
+    
+    def load(self, file_object):  # IOError, CatalogFormatError
+        self.members.clear()
+        self.chunks.clear()
+        if file_object.readline().rstrip(STR_EOL) != STR_INDEX:
+            raise CatalogFormatError()
+        for s in file_object:
+            lst = s.rstrip(STR_EOL).split(STR_TAB)
+            try:
+                if lst[0] == STR_INDEX_END:
+                    return
+                elif (lst[0] == STR_CHUNK) and (len(lst) == 4):
+                    self.chunks.setdefault(int(lst[1]), []).append((int(lst[2]), int(lst[3])))
+                elif (lst[0] == STR_MEMBER) and (len(lst) == 5):
+                    self.add_member(int(lst[1]), int(lst[2]), int(lst[3]), lst[4])
+                else:
+                    raise CatalogFormatError()
+            except ValueError:
+                raise CatalogFormatError()
+        raise CatalogFormatError()
+    
+    # volumes without index (created by older version): read all volumes, chunks are not known
+    def scan(self, storage, path_list, stats):  # IOError, tarfile.TarError
+        self.members.clear()
+        self.chunks.clear()
+        for (number, path) in enumerate(path_list, 1):
+            ext = VOLUME_FILE_NAME.match(path).group(3)
+            if ext != STR_TAR_EXT:
+                self.chunks[number] = [(0, 0)]
+            with storage.open_read(path) as volume_file:  # IOError
+                stream = volume_stream(StatsFile(volume_file, stats, 'volume_read'), ext)
+                with tarfile.open(path, 'r|', fileobj=stream) as tar:
+                    for member in tar:  # tarfile.TarError
+                        if member.isfile():
+                            self.add_member(number, member.offset_data, member.size, member.name)
 
 
 # not correct for unicode file names
 class TarFileWriter:  # OSError, IOError, tarfile.TarError
-    def __init__(self, name, max_part_size, arch_type='tar'):
+    def __init__(self, name, max_part_size, arch_type='tar', stats=None, throttle=None, storage=None):
+        if storage is None:
+            storage = LocalStorage(os.path.dirname(name) or STR_POINT)
+            name = os.path.basename(name)
+        self.Storage = storage
         self.TarName = name
         self.PartNumber = 0
         self.PartSize = 0
         self.PartFile = None
+        self.RawFile = None
+        self.DataFile = None  # RawFile or CompressFile over it
+        self.Batch = bytearray()  # headers, data and padding of small members not written yet
+        self.Index = VolumeIndex()
+        self.PartStart = 0.0
+        self.PartBytes = 0
         self.Closed = True
+        self.Stats = stats if stats is not None else Stats()
+        self.Throttle = throttle
+        self.Owners = {}  # uid / gid -> user / group name
         self.MaxPartSize = (max_part_size // tarfile.RECORDSIZE) * tarfile.RECORDSIZE
         self.Type = arch_type.lower()
         if arch_type == 'tar':
             self.Ext = STR_TAR_EXT
-            self.Mode = 'w:'
         elif arch_type == 'gz':
             self.Ext = STR_GZ_EXT
-            self.Mode = 'w:gz'
         elif arch_type == 'bz2':
             self.Ext = STR_BZ2_EXT
-            self.Mode = 'w:bz2'
         else:
             raise IOError()
     
     def close(self):  # IOError
+        with self.Stats.phase('archive'):
+            self.__close()
+            # index of volumes: [name].idx
+            if self.PartNumber > 0:
+                with open_text(self.Storage, self.TarName + STR_IDX_EXT, 'w') as file_object:  # IOError
+                    self.Index.save(file_object)
+    
+    def __close(self):  # IOError
         if not self.Closed:
+            self.__flush()
             self.PartFile.close()
+            self.DataFile.close()
+            if self.DataFile is not self.RawFile:
+                self.Index.chunks[self.PartNumber] = self.DataFile.chunks
+            self.Stats.add_volume(os.path.basename(self.RawFile.name), self.PartSize,
+                                  self.Stats.get('volume_write_bytes') - self.PartBytes,
+                                  time.perf_counter() - self.PartStart)
             self.PartFile = None
+            self.RawFile = None
+            self.DataFile = None
             self.Closed = True
     
     def __new_part(self):  # IOError
-        self.close()
+        self.__close()
         self.PartNumber += 1
-        self.PartFile = tarfile.open(self.TarName + STR_POINT + str(self.PartNumber) + self.Ext, self.Mode)
+        part_name = self.TarName + STR_POINT + str(self.PartNumber) + self.Ext
+        self.PartStart = time.perf_counter()
+        self.PartBytes = self.Stats.get('volume_write_bytes')
+        self.RawFile = StatsFile(self.Storage.open_write(part_name), self.Stats, 'volume_write',
+                                 self.Throttle)  # IOError
+        if self.Ext == STR_TAR_EXT:
+            self.DataFile = self.RawFile
+        else:
+            self.DataFile = CompressFile(self.RawFile, self.Ext)
+        self.PartFile = tarfile.open(part_name, 'w:', fileobj=self.DataFile)
         self.PartSize = 0
         self.Closed = False
     
-    def add(self, file_path, tar_name):  # OSError, IOError, tarfile.TarError
-        if self.Closed:
-            self.__new_part()
-        # prepare file object
-        file_size = os.path.getsize(file_path)  # OSError
-        file_tar_info = self.PartFile.gettarinfo(file_path)  # tarfile.TarError
-        file_tar_info.name = tar_name
-        
-        with open(file_path, 'rb') as file_object:  # IOError
-            # copy file to tar
-            while (self.PartSize + file_size + 3*tarfile.BLOCKSIZE) > self.MaxPartSize:
-                file_size_to_save = self.MaxPartSize - self.PartSize - 3*tarfile.BLOCKSIZE
-                file_tar_info.size = file_size_to_save
-                self.PartFile.addfile(file_tar_info, file_object)  # tarfile.TarError
-                self.PartSize = self.PartSize + tarfile.BLOCKSIZE + file_size_to_save
-                assert (self.PartSize + 2*tarfile.BLOCKSIZE) == self.MaxPartSize
+    # header from stat result of file, without gettarinfo (one more stat and user / group lookups per file)
+    def __tar_info(self, tar_name, file_stat):
+        file_tar_info = tarfile.TarInfo(tar_name)
+        file_tar_info.mode = stat.S_IMODE(file_stat.st_mode)
+        file_tar_info.uid = file_stat.st_uid
+        file_tar_info.gid = file_stat.st_gid
+        file_tar_info.size = file_stat.st_size
+        file_tar_info.mtime = file_stat.st_mtime
+        if ('u', file_stat.st_uid) not in self.Owners:
+            self.Owners[('u', file_stat.st_uid)] = STR_EMPTY
+            if pwd is not None:
+                try:
+                    self.Owners[('u', file_stat.st_uid)] = pwd.getpwuid(file_stat.st_uid)[0]
+                except KeyError:
+                    pass
+        if ('g', file_stat.st_gid) not in self.Owners:
+            self.Owners[('g', file_stat.st_gid)] = STR_EMPTY
+            if grp is not None:
+                try:
+                    self.Owners[('g', file_stat.st_gid)] = grp.getgrgid(file_stat.st_gid)[0]
+                except KeyError:
+                    pass
+        file_tar_info.uname = self.Owners[('u', file_stat.st_uid)]
+        file_tar_info.gname = self.Owners[('g', file_stat.st_gid)]
+        return file_tar_info
+    
+    # file_stat - os.stat result of file, if already known
+    def add(self, file_path, tar_name, file_stat=None):  # OSError, IOError, tarfile.TarError
+        with self.Stats.phase('archive'):
+            if self.Closed:
                 self.__new_part()
-                file_size -= file_size_to_save
-                
-            file_tar_info.size = file_size
+            # prepare file object
+            if file_stat is None:
+                file_stat = os.stat(file_path)  # OSError
+            file_tar_info = self.__tar_info(tar_name, file_stat)
+            
+            with open(file_path, 'rb') as source_file:  # IOError
+                self.__add(StatsFile(source_file, self.Stats, 'source_read', self.Throttle),
+                           file_tar_info, file_stat.st_size)
+            if (self.PartSize + 3*tarfile.BLOCKSIZE) >= self.MaxPartSize:
+                self.__close()
+    
+    # add small file already read to memory (see read_hash)
+    def add_data(self, data, tar_name, file_stat):  # IOError, tarfile.TarError
+        with self.Stats.phase('archive'):
+            if self.Closed:
+                self.__new_part()
+            file_tar_info = self.__tar_info(tar_name, file_stat)
+            if (self.PartSize + tarfile.BLOCKSIZE + tar_blocks(len(data)) + 2*tarfile.BLOCKSIZE) <= self.MaxPartSize:
+                self.__add_batch(data, file_tar_info)
+            else:
+                self.__add(io.BytesIO(data), file_tar_info, len(data))
+            if (self.PartSize + 3*tarfile.BLOCKSIZE) >= self.MaxPartSize:
+                self.__close()
+    
+    # add file_tar_info.size bytes from opened file object (member of other volume, temporary file)
+    def add_object(self, file_object, file_tar_info):  # IOError, tarfile.TarError
+        with self.Stats.phase('archive'):
+            if self.Closed:
+                self.__new_part()
+            self.__add(file_object, copy.copy(file_tar_info), file_tar_info.size)
+            if (self.PartSize + 3*tarfile.BLOCKSIZE) >= self.MaxPartSize:
+                self.__close()
+    
+    # member that fits in current volume: header (TarInfo.tobuf as in TarFile.addfile), data and padding
+    # are appended to Batch, which is written to volume by one write of COPY_BUFFER_SIZE
+    def __add_batch(self, data, file_tar_info):  # IOError, tarfile.TarError
+        file_tar_info.size = len(data)
+        self.Batch += file_tar_info.tobuf(self.PartFile.format, self.PartFile.encoding,
+                                          self.PartFile.errors)  # tarfile.TarError
+        self.Index.add_member(self.PartNumber, self.PartFile.offset + len(self.Batch), len(data),
+                              file_tar_info.name)
+        self.Batch += data
+        self.Batch += bytes(tar_blocks(len(data)) - len(data))
+        self.PartSize = self.PartSize + tarfile.BLOCKSIZE + tar_blocks(len(data))
+        if len(self.Batch) >= COPY_BUFFER_SIZE:
+            self.__flush()
+    
+    # write Batch to volume, TarFile only counts its offset (for end of archive blocks on close)
+    def __flush(self):  # IOError
+        if len(self.Batch) > 0:
+            self.DataFile.write(bytes(self.Batch))
+            self.PartFile.offset += len(self.Batch)
+            self.Batch = bytearray()
+    
+    def __add(self, file_object, file_tar_info, file_size):  # IOError, tarfile.TarError
+        self.__flush()
+        # copy file to tar
+        while (self.PartSize + file_size + 3*tarfile.BLOCKSIZE) > self.MaxPartSize:
+            file_size_to_save = self.MaxPartSize - self.PartSize - 3*tarfile.BLOCKSIZE
+            file_tar_info.size = file_size_to_save
             self.PartFile.addfile(file_tar_info, file_object)  # tarfile.TarError
-            # recalculate PartSize
-            self.PartSize = self.PartSize + tarfile.BLOCKSIZE + (file_size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
-            if (file_size % tarfile.BLOCKSIZE) > 0:
-                self.PartSize += tarfile.BLOCKSIZE
+            self.Index.add_member(self.PartNumber, self.PartFile.offset - tar_blocks(file_size_to_save),
+                                  file_size_to_save, file_tar_info.name)
+            self.PartSize = self.PartSize + tarfile.BLOCKSIZE + file_size_to_save
+            assert (self.PartSize + 2*tarfile.BLOCKSIZE) == self.MaxPartSize
+            self.__new_part()
+            file_size -= file_size_to_save
+            
+        file_tar_info.size = file_size
+        self.PartFile.addfile(file_tar_info, file_object)  # tarfile.TarError
+        self.Index.add_member(self.PartNumber, self.PartFile.offset - tar_blocks(file_size),
+                              file_size, file_tar_info.name)
+        # recalculate PartSize
+        self.PartSize = self.PartSize + tarfile.BLOCKSIZE + (file_size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+        if (file_size % tarfile.BLOCKSIZE) > 0:
+            self.PartSize += tarfile.BLOCKSIZE
         
         assert (self.PartSize + 2*tarfile.BLOCKSIZE) <= self.MaxPartSize
-        
-        if (self.PartSize + 3*tarfile.BLOCKSIZE) >= self.MaxPartSize:
-            self.close()
 
 
 # not correct for unicode file names
 class TarFileReader:  # KeyError, IOError, tarfile.TarError
-    def __init__(self, name):
+    def __init__(self, name, stats=None, storage=None):
+        if storage is None:
+            storage = LocalStorage(os.path.dirname(name) or STR_POINT)
+            name = os.path.basename(name)
+        self.Storage = storage
         self.TarName = name
         self.PartNumber = 0
         self.PartFile = None
+        self.RawFile = None
         self.Closed = True
-        if os.path.isfile(name + '.1' + STR_TAR_EXT):
-            self.Ext = STR_TAR_EXT
-        elif os.path.isfile(name + '.1' + STR_GZ_EXT):
-            self.Ext = STR_GZ_EXT
-        elif os.path.isfile(name + '.1' + STR_BZ2_EXT):
-            self.Ext = STR_BZ2_EXT
-        else:
+        self.Stats = stats if stats is not None else Stats()
+        self.Ext = volume_ext(storage, name)
+        if self.Ext is None:
             raise IOError()
     
     def close(self):  # IOError
         if not self.Closed:
             self.PartFile.close()
+            self.RawFile.close()
             self.PartFile = None
+            self.RawFile = None
             self.Closed = True
     
     def __next_part(self):  # IOError
         self.close()
         self.PartNumber += 1
-        self.PartFile = tarfile.open(self.TarName + STR_POINT + str(self.PartNumber) + self.Ext)
+        part_name = self.TarName + STR_POINT + str(self.PartNumber) + self.Ext
+        # split file continues in next volume: start its download
+        self.Storage.prefetch(self.TarName + STR_POINT + str(self.PartNumber + 1) + self.Ext)
+        self.RawFile = StatsFile(self.Storage.open_read(part_name), self.Stats, 'volume_read')  # IOError
+        try:
+            self.PartFile = tarfile.open(part_name, fileobj=self.RawFile)
+        except tarfile.TarError:
+            self.RawFile.close()
+            raise
+        self.Closed = False
     
     def extract(self, tar_name, file_path):  # KeyError, IOError, tarfile.TarError
+        with self.Stats.phase('extract'):
+            self.__extract(tar_name, file_path)
+    
+    def __extract(self, tar_name, file_path):  # KeyError, IOError, tarfile.TarError
         self.PartNumber = 0
         
         # ищем первый том в котором есть такой файл
@@ -465,7 +1824,8 @@ class TarFileReader:  # KeyError, IOError, tarfile.TarError
                 pass
         
         if found:
-            with open(file_path, 'wb') as file_object:  # IOError
+            with open(file_path, 'wb') as destination_file:  # IOError
+                file_object = StatsFile(destination_file, self.Stats, 'destination_write')
                 while found:
                     # копируем в файл
                     tar_buffer = self.PartFile.extractfile(file_tar_info)  # tarfile.TarError
@@ -490,43 +1850,138 @@ class TarFileReader:  # KeyError, IOError, tarfile.TarError
             raise KeyError()
 
 
-def sh_create(sh_args):
+def write_lock(storage, name):  # IOError
+    with open_text(storage, name, 'w') as file_object:  # IOError
+        file_object.write(platform.node() + STR_TAB + str(os.getpid()) + STR_TAB +
+                          time.strftime('%Y-%m-%d %H:%M:%S') + STR_EOL)
+    storage.flush()  # IOError
+
+
+def lock_repository(storage):  # IOError
+    # prune / compact don't start while other prune / compact or create is running
+    if REPOSITORY_LOCK in storage.list():  # IOError
+        print('ERROR: Repository is locked by prune / compact! Remove ' + REPOSITORY_LOCK +
+              ' if it is not running.')
+        return False
+    write_lock(storage, REPOSITORY_LOCK)  # IOError
+    running = sorted([name for name in storage.list() if name.endswith(STR_LOCK_EXT)])  # IOError
+    if running:
+        storage.remove(REPOSITORY_LOCK)  # IOError
+        for name in running:
+            print('ERROR: Backup is being created: ' + name[:-len(STR_LOCK_EXT)] + '! Remove ' + name +
+                  ' if create is not running.')
+        return False
+    return True
+
+
+def sh_create(sh_args, stats, storage):
     # check source
     if not os.path.isdir(sh_args.source):
         print('ERROR: Source not found!')
         return
     
     # check repository
-    if not os.path.isdir(sh_args.repository):
+    if not storage.is_valid():
         print('ERROR: Repository not found!')
         return
     
     # check if files with backup name exist
-    if os.path.isfile(sh_args.repository + STR_SLASH + sh_args.name + STR_CAT_EXT):
+    if storage.exists(sh_args.name + STR_CAT_EXT):
         print('ERROR: Such archive already exists!')
         return
-            
+    
+    # check throttling options
+    if sh_args.adaptive and (sh_args.read_limit is None) and (sh_args.write_limit is None):
+        print('ERROR: Adaptive mode requires --read-limit or --write-limit!')
+        return
+    if sh_args.adaptive and (read_io_pressure() is None):
+        print('WARNING: I/O pressure is not available, adaptive mode is disabled.')
+    
+    # prune / compact don't remove volumes of backup while [name].lock exists
+    lock_name = sh_args.name + STR_LOCK_EXT
+    try:
+        if lock_name in storage.list():
+            print('ERROR: Such archive is being created! Remove ' + lock_name + ' if create is not running.')
+            return
+        write_lock(storage, lock_name)
+        if REPOSITORY_LOCK in storage.list():
+            storage.remove(lock_name)
+            print('ERROR: Repository is locked by prune / compact!')
+            return
+    except IOError:
+        print('ERROR: Can not create lock file: ' + lock_name)
+        return
+    try:
+        create_backup(sh_args, stats, storage)
+    finally:
+        try:
+            storage.remove(lock_name)
+        except IOError:
+            print('WARNING: Can not remove lock file: ' + lock_name)
+
+
+def create_backup(sh_args, stats, storage):
+    # lower CPU / IO priority
+    if sh_args.background:
+        set_priority(19 if sh_args.nice is None else sh_args.nice,
+                     'idle' if sh_args.ionice is None else sh_args.ionice)
+    else:
+        set_priority(sh_args.nice, sh_args.ionice)
+    throttle = None
+    if (sh_args.read_limit is not None) or (sh_args.write_limit is not None):
+        throttle = Throttle(sh_args.read_limit*1024*1024 if sh_args.read_limit else None,
+                            sh_args.write_limit*1024*1024 if sh_args.write_limit else None,
+                            sh_args.adaptive, stats)
+    
     # create empty reference and hash lists
     reference_list = FileList()
     hash_list = HashList()
+    reference_ok = True
 
     # load reference and hash lists
     if sh_args.reference is not None:
         # check if reference file exists
-        ref_path = sh_args.repository + '/' + sh_args.reference + STR_CAT_EXT
-        if not os.path.isfile(ref_path):
+        ref_name = sh_args.reference + STR_CAT_EXT
+        if not storage.exists(ref_name):
             print('ERROR: Reference not found!')
             return
-        reference_list.load_file(ref_path)
-        hash_list.load_file(ref_path)
+        reference_ok = reference_list.load_file(ref_name, stats, storage)
+        reference_ok = hash_list.load_file(ref_name, stats, storage) and reference_ok and \
+            catalog_complete(reference_list, hash_list)
 
+    # journal of reference for fast scan
+    journal = Journal(os.path.abspath(sh_args.source), json.dumps([sh_args.include, sh_args.exclude]))
+    fast = None
+    if sh_args.fast and (sh_args.reference is not None) and (not reference_ok):
+        # files of not changed directories can't be taken from damaged reference
+        print('WARNING: Reference catalogue is damaged, full scan is done.')
+    elif sh_args.fast and (sh_args.reference is not None):
+        reference_journal = Journal()
+        try:
+            if sh_args.recalculate:
+                raise CatalogFormatError()
+            with open_text(storage, sh_args.reference + STR_JNL_EXT) as file_object:  # IOError
+                reference_journal.load(file_object)  # CatalogFormatError
+            if not journal.matches(reference_journal):
+                raise CatalogFormatError()
+            reference_journal.drop_racy()
+            fast = FastScan(reference_list, reference_journal)
+        except (IOError, CatalogFormatError):
+            print('WARNING: No journal of reference for this source and masks, full scan is done.')
+    
     # create list of files/dirs in source destination
     source_list = FileList()
-    source_list.read_dir_list(sh_args.source)
+    with stats.phase('walk'):
+        source_list.read_dir_list(sh_args.source, journal, fast)
+    stats.count('entries', len(source_list.dict))
+    stats.count('dirs', len(journal.dirs))
+    if fast is not None:
+        stats.count('dirs_reused', fast.reused_dirs)
 
     # include / exclude files / dirs
-    source_list.include_hierarchy(sh_args.include)
-    source_list.exclude(sh_args.exclude)
+    with stats.phase('filter'):
+        source_list.include_hierarchy(sh_args.include)
+        source_list.exclude(sh_args.exclude)
 
     # compression
     compr = 'tar'
@@ -534,7 +1989,7 @@ def sh_create(sh_args):
         compr = sh_args.compression
     
     # create TarFileWriter
-    writer = TarFileWriter(sh_args.repository + STR_SLASH + sh_args.name, sh_args.size, compr)
+    writer = TarFileWriter(sh_args.name, sh_args.size, compr, stats, throttle, storage)
     # check files and if new/changed add to archive
     c_all = 0
     c_new = 0
@@ -544,33 +1999,54 @@ def sh_create(sh_args):
     key_list.sort()
     for file_name in key_list:
         file_path = sh_args.source + file_name
-        if not source_list.dict[file_name].isDir:
+        if (fast is not None) and (file_name in fast.reused):
+            # not changed directory: mtime, size and hash from reference
+            stats.count('files_reference')
+            stats.count('files_reused')
+            size_all = size_all + source_list.dict[file_name].size
+            c_all += 1
+        elif not source_list.dict[file_name].isDir:
             ok = False
             while not ok:
                 try:
                     # get date and size
-                    source_list.dict[file_name].mtime = int(os.path.getmtime(file_path))
-                    source_list.dict[file_name].size = os.path.getsize(file_path)
+                    with stats.phase('stat'):
+                        file_stat = os.stat(file_path)
+                        source_list.dict[file_name].mtime = int(file_stat.st_mtime)
+                        source_list.dict[file_name].size = file_stat.st_size
                     # check if such file is in reference
                     if (not sh_args.recalculate) and (file_name in reference_list.dict) and \
                             (not reference_list.dict[file_name].isDir) and \
                             (source_list.dict[file_name].mtime == reference_list.dict[file_name].mtime) and \
                             (source_list.dict[file_name].size == reference_list.dict[file_name].size):
                         source_list.dict[file_name].hash = reference_list.dict[file_name].hash
+                        stats.count('files_reference')
                     else:
                         # calculate hash
-                        source_list.dict[file_name].hash = calc_hash(file_path)
+                        data = None
+                        with stats.phase('hash'):
+                            if file_stat.st_size <= SMALL_FILE_SIZE:
+                                (data, source_list.dict[file_name].hash) = read_hash(file_path, stats, throttle)
+                                source_list.dict[file_name].size = len(data)
+                            else:
+                                source_list.dict[file_name].hash = calc_hash(file_path, stats, throttle)
                         # add file to archive
                         tar_name = hash_name(source_list.dict[file_name])
                         if tar_name not in hash_list.dict:
                             hash_list.dict[tar_name] = sh_args.name
-                            writer.add(sh_args.source + file_name, tar_name)
+                            if data is not None:
+                                writer.add_data(data, tar_name, file_stat)
+                            else:
+                                writer.add(file_path, tar_name, file_stat)
                             c_new += 1
                             size_new = size_new + source_list.dict[file_name].size
+                        else:
+                            stats.count('files_duplicate')
                     size_all = size_all + source_list.dict[file_name].size
                     ok = True
                 except (OSError, IOError) as e:
                     print('ERROR: Can not read: ' + e.filename)
+                    stats.count('errors')
                     if sh_args.ignore:
                         answer = 'i'
                     else:
@@ -580,6 +2056,8 @@ def sh_create(sh_args):
                         return
                     elif answer == 'i':
                         del source_list.dict[file_name]
+                        # directory of skipped file is listed again by next fast scan
+                        journal.dirs[file_name.rpartition(STR_SLASH)[0]] = NO_MTIME
                         ok = True
                 except tarfile.TarError:
                     print('ERROR: Can not write files to archive!')
@@ -589,9 +2067,14 @@ def sh_create(sh_args):
                         return
             c_all += 1
         if not sh_args.quiet:
-            sys.stdout.write("\rFiles (New/All): %s / %s, Size (New/All): %.02f Mb / %.02f Mb" % (
-                             c_new, c_all, size_new/1024.0/1024.0, size_all/1024.0/1024.0))
-            sys.stdout.flush()
+            with stats.phase('progress'):
+                sys.stdout.write("\rFiles (New/All): %s / %s, Size (New/All): %.02f Mb / %.02f Mb" % (
+                                 c_new, c_all, size_new/1024.0/1024.0, size_all/1024.0/1024.0))
+                sys.stdout.flush()
+    stats.count('files', c_all)
+    stats.count('files_new', c_new)
+    stats.count('size', size_all)
+    stats.count('size_new', size_new)
     
     # close TarFileWriter
     writer.close()
@@ -600,13 +2083,22 @@ def sh_create(sh_args):
         sys.stdout.write(STR_EOL)
         sys.stdout.flush()
     
+    # catalogue is written only after all volumes are stored
+    try:
+        storage.flush()
+    except IOError:
+        print('ERROR: Can not write volumes!')
+        return
+    
     # save catalogue
     try:
-        file_object = open(sh_args.repository + STR_SLASH + sh_args.name + STR_CAT_EXT,
-                           mode='w', encoding='utf-8')
+        file_object = open_text(storage, sh_args.name + STR_CAT_EXT, 'w')
         try:
-            source_list.save(file_object)
-            hash_list.save(file_object)
+            with stats.phase('catalog_write'):
+                source_list.save(file_object)
+                hash_list.save(file_object)
+                file_object.flush()
+            stats.count('catalog_write_bytes', file_object.buffer.tell())
         except IOError:
             print('ERROR: Can not create catalogue file!')
             return
@@ -614,16 +2106,24 @@ def sh_create(sh_args):
             file_object.close()
     except IOError:
         print('ERROR: Can not create catalogue file!')
+        return
+    
+    # save journal for next fast scan
+    try:
+        with open_text(storage, sh_args.name + STR_JNL_EXT, 'w') as file_object:
+            journal.save(file_object)
+    except IOError:
+        print('WARNING: Can not create journal file!')
 
 
-def sh_find(sh_args):
+def sh_find(sh_args, stats, storage):
     # check repository
-    if not os.path.isdir(sh_args.repository):
+    if not storage.is_valid():
         print('ERROR: Repository not found!\n')
         return
     
     # get file list
-    cat_list = os.listdir(sh_args.repository)
+    cat_list = list(storage.list())
     cat_list.sort()
     key_list = list(cat_list)
     for key in key_list:
@@ -639,27 +2139,32 @@ def sh_find(sh_args):
     for cat in cat_list:
         # loading catalogue
         file_list = FileList()
-        file_list.load_file(sh_args.repository + STR_SLASH + cat)
+        file_list.load_file(cat, stats, storage)
+        stats.count('catalogs')
+        stats.count('entries', len(file_list.dict))
         
         # include / exclude files / dirs
-        file_list.include(sh_args.include)
-        file_list.exclude(sh_args.exclude)
+        with stats.phase('filter'):
+            file_list.include(sh_args.include)
+            file_list.exclude(sh_args.exclude)
         
         # looking for matching files and dirs
-        key_list = list(file_list.dict.keys())
-        key_list.sort()
-        for key in key_list:
-            print(cat + ': ' + key)
+        with stats.phase('output'):
+            key_list = list(file_list.dict.keys())
+            key_list.sort()
+            for key in key_list:
+                print(cat + ': ' + key)
+        stats.count('found', len(key_list))
 
 
-def sh_restore(sh_args):
+def sh_restore(sh_args, stats, storage):
     # check repository
-    if not os.path.isdir(sh_args.repository):
+    if not storage.is_valid():
         print('ERROR: Repository not found!\n')
         return
     
     # check existence of catalogue file
-    if not os.path.isfile(sh_args.repository + STR_SLASH + sh_args.name + STR_CAT_EXT):
+    if not storage.exists(sh_args.name + STR_CAT_EXT):
         print('ERROR: Catalogue not found!\n')
         return
     
@@ -671,19 +2176,31 @@ def sh_restore(sh_args):
     # read FileList and HashList from catalogue
     source_list = FileList()
     hash_list = HashList()
-    source_list.load_file(sh_args.repository + STR_SLASH + sh_args.name + STR_CAT_EXT)
-    hash_list.load_file(sh_args.repository + STR_SLASH + sh_args.name + STR_CAT_EXT)
+    source_list.load_file(sh_args.name + STR_CAT_EXT, stats, storage)
+    hash_list.load_file(sh_args.name + STR_CAT_EXT, stats, storage)
+    stats.count('entries', len(source_list.dict))
     
     # include / exclude files / dirs
-    source_list.fix_hierarchy()
-    source_list.include_hierarchy(sh_args.include)
-    source_list.exclude(sh_args.exclude)
+    with stats.phase('filter'):
+        source_list.fix_hierarchy()
+        source_list.include_hierarchy(sh_args.include)
+        source_list.exclude(sh_args.exclude)
     
-    # create not existing dirs and extract new or changed files
+    # create not existing dirs, find new or changed files
     c_all = 0
     c_new = 0
     size_all = 0
     size_new = 0
+    pending = []  # files to extract
+    failed = set()  # files not restored
+    
+    def show_progress():
+        if not sh_args.quiet:
+            with stats.phase('progress'):
+                sys.stdout.write("\rFiles (New/All): %s / %s, Size (New/All): %.02f Mb / %.02f Mb" % (
+                                 c_new, c_all, size_new/1024.0/1024.0, size_all/1024.0/1024.0))
+                sys.stdout.flush()
+    
     key_list = list(source_list.dict)
     key_list.sort()
     for file_name in key_list:
@@ -711,29 +2228,24 @@ def sh_restore(sh_args):
                     return
                 elif answer == 'i':
                     ok = True
-        # restore file
+        # check if such file exists
         if not source_list.dict[file_name].isDir:
-            hash_key = hash_name(source_list.dict[file_name])
-            backup_file = hash_list.dict[hash_key]
             ok = False
             while not ok:
                 try:
-                    # check if such file exists
-                    reader = TarFileReader(sh_args.repository + STR_SLASH + backup_file)
-                    if os.path.isfile(file_path) and \
+                    with stats.phase('check'):
+                        unchanged = os.path.isfile(file_path) and \
                             (source_list.dict[file_name].mtime == int(os.path.getmtime(file_path))) and \
                             (source_list.dict[file_name].size == os.path.getsize(file_path)) and \
-                            (source_list.dict[file_name].hash == calc_hash(file_path)):
-                        pass
+                            (source_list.dict[file_name].hash == calc_hash(file_path, stats))
+                    if unchanged:
+                        stats.count('files_unchanged')
                     else:
-                        if os.path.isdir(file_path):
-                            shutil.rmtree(file_path)
-                        reader.extract(hash_key, file_path)
-                        c_new += 1
-                        size_new = size_new + source_list.dict[file_name].size
+                        pending.append(file_name)
                     ok = True
                 except (OSError, IOError) as e:
-                    print('ERROR: Can not restore file: ' + e.filename)
+                    print('ERROR: Can not read file: ' + e.filename)
+                    stats.count('errors')
                     if sh_args.ignore:
                         answer = 'i'
                     else:
@@ -741,17 +2253,97 @@ def sh_restore(sh_args):
                     if answer == 'a':
                         return
                     elif answer == 'i':
+                        failed.add(file_name)
                         ok = True
-                finally:
-                    reader.close()
             c_all += 1
             size_all = size_all + source_list.dict[file_name].size
-        # set time
+        show_progress()
+    
+    # indexes of volumes: objects are extracted in order of volumes, only their ranges are read
+    readers = {}  # backup -> VolumeReader
+    for backup in sorted(set([hash_list.dict[hash_name(source_list.dict[file_name])] for file_name in pending])):
+        ok = False
+        while not ok:
+            try:
+                readers[backup] = VolumeReader(storage, backup, load_index(storage, backup, stats), stats)
+                ok = True
+            except (IOError, tarfile.TarError):
+                print('ERROR: Can not read volumes: ' + backup)
+                stats.count('errors')
+                if sh_args.ignore:
+                    answer = 'i'
+                else:
+                    answer = input('Abort (a) / Ignore (i) / Retry (other): ')
+                if answer == 'a':
+                    return
+                elif answer == 'i':
+                    ok = True
+    
+    # backup and pieces [(volume number, tar offset, size)] of object of every file
+    pieces = {}
+    for file_name in pending:
+        hash_key = hash_name(source_list.dict[file_name])
+        backup = hash_list.dict[hash_key]
+        if backup in readers:
+            pieces[file_name] = (backup, sorted(readers[backup].index.members.get(hash_key, [])))
+        else:
+            pieces[file_name] = (backup, [])
+    pending.sort(key=lambda file_name: (pieces[file_name][0], pieces[file_name][1][:1]))
+    for file_name in pending:
+        (backup, piece_list) = pieces[file_name]
+        for piece in piece_list:
+            readers[backup].need(*piece)
+    
+    # extract new or changed files
+    for file_name in pending:
+        file_path = sh_args.destination + file_name
+        (backup, piece_list) = pieces[file_name]
+        ok = False
+        while not ok:
+            try:
+                if sum([size for (volume, offset, size) in piece_list]) != source_list.dict[file_name].size:
+                    raise IOError('Object not found in volumes: ' + backup)
+                if os.path.isdir(file_path):
+                    shutil.rmtree(file_path)
+                with stats.phase('extract'):
+                    with open(file_path, 'wb') as destination_file:  # IOError
+                        file_object = StatsFile(destination_file, stats, 'destination_write')
+                        for (volume, offset, size) in piece_list:
+                            readers[backup].copy(volume, offset, size, file_object)  # IOError
+                c_new += 1
+                size_new = size_new + source_list.dict[file_name].size
+                ok = True
+            except (OSError, IOError) as e:
+                print('ERROR: Can not restore file: ' + file_path + ' (' + str(e) + ')')
+                stats.count('errors')
+                if sh_args.ignore:
+                    answer = 'i'
+                else:
+                    answer = input('Abort (a) / Ignore (i) / Retry (other): ')
+                if answer == 'a':
+                    return
+                elif answer == 'i':
+                    failed.add(file_name)
+                    ok = True
+        show_progress()
+    for backup in readers:
+        readers[backup].close()
+    stats.count('files', c_all)
+    stats.count('files_new', c_new)
+    stats.count('size', size_all)
+    stats.count('size_new', size_new)
+    
+    # set time, directories after all their files are written
+    for file_name in key_list:
+        if file_name in failed:
+            continue
+        file_path = sh_args.destination + file_name
         ok = False
         while not ok:
             try:
-                os.utime(file_path, (source_list.dict[file_name].mtime,
-                         source_list.dict[file_name].mtime))
+                with stats.phase('utime'):
+                    os.utime(file_path, (source_list.dict[file_name].mtime,
+                             source_list.dict[file_name].mtime))
                 ok = True
             except OSError as e:
                 print('ERROR: Can not update time for: ' + e.filename)
@@ -763,17 +2355,16 @@ def sh_restore(sh_args):
                     return
                 elif answer == 'i':
                     ok = True
-        sys.stdout.write("\rFiles (New/All): %s / %s, Size (New/All): %.02f Mb / %.02f Mb" % (
-                         c_new, c_all, size_new/1024.0/1024.0, size_all/1024.0/1024.0))
-        sys.stdout.flush()
     
-    sys.stdout.write(STR_EOL)
-    sys.stdout.flush()
+    if not sh_args.quiet:
+        sys.stdout.write(STR_EOL)
+        sys.stdout.flush()
     
     # get FileList for destination
     if sh_args.delete:
         destination_list = FileList()
-        destination_list.read_dir_list(sh_args.destination)
+        with stats.phase('walk'):
+            destination_list.read_dir_list(sh_args.destination)
         # remove old files
         key_list = list(destination_list.dict.keys())
         key_list.sort()
@@ -820,6 +2411,956 @@ def sh_restore(sh_args):
                         elif answer == 'i':
                             ok = True
 
+# write-only file object: checksum of written data
+class HashFile():
+    def __init__(self, stats):
+        self.hasher = hashlib.sha256()
+        self.stats = stats
+    
+    def write(self, data):
+        self.hasher.update(data)
+        self.stats.count('hash_bytes', len(data))
+        return len(data)
+    
+    def hexdigest(self):
+        return self.hasher.hexdigest()
+
+
+def verify_volume(storage, path):  # IOError, tarfile.TarError
+    # read volume once, check checksums of whole objects, return pieces of split objects
+    # returns (stats, [(name, ok)], [(piece name, tar offset, piece size)], [names of unknown members])
+    stats = Stats()
+    whole = []
+    pieces = []
+    other = []
+    with storage.open_read(path) as volume_file:  # IOError
+        stream = volume_stream(StatsFile(volume_file, stats, 'volume_read'), VOLUME_FILE_NAME.match(path).group(3))
+        with tarfile.open(path, 'r|', fileobj=stream) as tar:
+            for member in tar:  # tarfile.TarError
+                try:
+                    (h, size) = split_hash_name(member.name)
+                except HashNameError:
+                    other.append(member.name)
+                    continue
+                if not member.isfile():
+                    other.append(member.name)
+                elif member.size == size:
+                    hash_file = HashFile(stats)
+                    with stats.phase('hash'):
+                        tar_buffer = tar.extractfile(member)
+                        block = tar_buffer.read(HASH_BLOCK_SIZE)
+                        while block:
+                            hash_file.write(block)
+                            block = tar_buffer.read(HASH_BLOCK_SIZE)
+                    whole.append((member.name, hash_file.hexdigest() == h))
+                else:
+                    pieces.append((member.name, member.offset_data, member.size))
+    stats.count('volumes')
+    return stats, whole, pieces, other
+
+
+def verify_split(storage, backup, objects):  # IOError
+    # checksums of objects split across volumes, only their pieces are read
+    # objects - [(name, [(volume number, tar offset, size)])] sorted by first piece
+    # returns (stats, [(name, ok)])
+    stats = Stats()
+    # chunks of compressed volumes from index: decompression starts at the nearest chunk
+    index = VolumeIndex()
+    try:
+        if storage.exists(backup + STR_IDX_EXT):
+            with open_text(storage, backup + STR_IDX_EXT) as file_object:  # IOError
+                index.load(file_object)  # CatalogFormatError
+    except (IOError, CatalogFormatError):
+        index = VolumeIndex()
+    index.members.clear()
+    reader = VolumeReader(storage, backup, index, stats)  # IOError
+    for (number, path) in reader.volumes.items():
+        if (VOLUME_FILE_NAME.match(path).group(3) != STR_TAR_EXT) and (number not in index.chunks):
+            index.chunks[number] = [(0, 0)]
+    for (name, piece_list) in objects:
+        for piece in piece_list:
+            reader.need(*piece)
+    result = []
+    try:
+        for (name, piece_list) in objects:
+            hash_file = HashFile(stats)
+            try:
+                with stats.phase('hash'):
+                    for (number, offset, size) in piece_list:
+                        reader.copy(number, offset, size, hash_file)  # IOError
+                result.append((name, hash_file.hexdigest() == split_hash_name(name)[0]))
+            except IOError:
+                reader.close()
+                result.append((name, False))
+    finally:
+        reader.close()
+    return stats, result
+
+
+def sh_verify(sh_args, stats, storage):
+    # check repository
+    if not storage.is_valid():
+        print('ERROR: Repository not found!\n')
+        return 1
+    
+    # check existence of catalogue file
+    if not storage.exists(sh_args.name + STR_CAT_EXT):
+        print('ERROR: Catalogue not found!\n')
+        return 1
+    
+    # read catalogue: damaged catalogue is an error, not an empty backup
+    try:
+        (file_list, hash_list) = load_catalog(storage, sh_args.name + STR_CAT_EXT, stats)
+    except (IOError, CatalogFormatError):
+        print('ERROR: Can not read catalogue: ' + sh_args.name + STR_CAT_EXT)
+        return 1
+    
+    # volumes of all backups referenced by catalogue
+    volumes = []  # (backup, volume number, path)
+    for backup in sorted(set(hash_list.dict.values())):
+        for (i, path) in enumerate(volume_list(storage, backup)):
+            volumes.append((backup, i + 1, path))
+    
+    # random sample of volumes
+    sample = (sh_args.sample is not None) and (sh_args.sample < 100)
+    if sample:
+        count = min(len(volumes), max(1, (len(volumes) * sh_args.sample + 99) // 100))
+        volumes = sorted(random.Random(sh_args.seed).sample(volumes, count))
+    
+    corrupt = []
+    missing = []
+    unreferenced = []
+    damaged = []
+    found = set()  # (backup, name)
+    pieces = {}  # (backup, name) -> [(volume number, tar offset, piece size)]
+    skipped = 0
+    
+    with concurrent.futures.ThreadPoolExecutor(max_workers=sh_args.jobs or os.cpu_count() or 1) as pool:
+        # read volumes in parallel
+        futures = [pool.submit(verify_volume, storage, path) for (backup, number, path) in volumes]
+        for (backup, number, path), future in zip(volumes, futures):
+            try:
+                (volume_stats, whole, volume_pieces, other) = future.result()
+            except (IOError, tarfile.TarError):
+                damaged.append(path)
+                continue
+            stats.merge(volume_stats)
+            for (name, ok) in whole:
+                found.add((backup, name))
+                if not ok:
+                    corrupt.append(backup + ': ' + name)
+                if hash_list.dict.get(name) != backup:
+                    unreferenced.append(backup + ': ' + name)
+            for (name, offset, size) in volume_pieces:
+                pieces.setdefault((backup, name), []).append((number, offset, size))
+            for name in other:
+                unreferenced.append(backup + ': ' + name)
+        
+        # objects split across volumes: pieces are read by ranges, backups in parallel
+        split = {}  # backup -> [(name, pieces)]
+        for (backup, name) in sorted(pieces):
+            piece_list = sorted(pieces[(backup, name)])
+            numbers = [number for (number, offset, size) in piece_list]
+            found.add((backup, name))
+            if hash_list.dict.get(name) != backup:
+                unreferenced.append(backup + ': ' + name)
+            if (sum([size for (number, offset, size) in piece_list]) != split_hash_name(name)[1]) or \
+                    (numbers != list(range(numbers[0], numbers[0] + len(numbers)))):
+                # pieces in volumes out of sample are not checked
+                if sample:
+                    skipped += 1
+                else:
+                    corrupt.append(backup + ': ' + name)
+                continue
+            split.setdefault(backup, []).append((name, piece_list))
+        futures = []
+        for backup in sorted(split):
+            split[backup].sort(key=lambda item: item[1][0])
+            futures.append((backup, pool.submit(verify_split, storage, backup, split[backup])))
+        for (backup, future) in futures:
+            try:
+                (split_stats, checked) = future.result()
+            except IOError:
+                corrupt.extend([backup + ': ' + name for (name, piece_list) in split[backup]])
+                continue
+            stats.merge(split_stats)
+            for (name, ok) in checked:
+                if not ok:
+                    corrupt.append(backup + ': ' + name)
+    
+    # objects not found in volumes (checked only if all volumes are read)
+    if not sample:
+        for name in sorted(hash_list.dict):
+            if (hash_list.dict[name], name) not in found:
+                missing.append(hash_list.dict[name] + ': ' + name)
+    
+    for path in damaged:
+        print('ERROR: Can not read volume: ' + path)
+    for name in sorted(corrupt):
+        print('CORRUPT: ' + name)
+    for name in missing:
+        print('MISSING: ' + name)
+    for name in sorted(unreferenced):
+        print('UNREFERENCED: ' + name)
+    
+    stats.count('objects', len(found))
+    stats.count('corrupt', len(corrupt))
+    stats.count('missing', len(missing))
+    stats.count('unreferenced', len(unreferenced))
+    stats.count('damaged_volumes', len(damaged))
+    stats.count('skipped', skipped)
+    if not sh_args.quiet:
+        print('Objects (Checked/Corrupt/Missing/Unreferenced): %s / %s / %s / %s, Volumes: %s, Size: %.02f Mb' % (
+              len(found) - skipped, len(corrupt), len(missing), len(unreferenced), len(volumes),
+              stats.get('hash_bytes')/1024.0/1024.0))
+    
+    # objects left in volumes by prune are reported, but are not errors
+    if damaged or corrupt or missing:
+        return 1
+    return 0
+
+
+# backup name -> file names of all its volumes sorted by volume number
+def volume_sets(storage):  # IOError
+    result = {}
+    for f in storage.list():  # IOError
+        m = VOLUME_FILE_NAME.match(f)
+        if m is not None:
+            result.setdefault(m.group(1), []).append((int(m.group(2)), f))
+    for name in result:
+        result[name] = [path for (number, path) in sorted(result[name])]
+    return result
+
+
+# names of all catalogues in repository (without extension)
+def catalog_list(storage):  # IOError
+    cat_list = []
+    for f in sorted(storage.list()):  # IOError
+        if f.endswith(STR_CAT_EXT):
+            cat_list.append(f[:-len(STR_CAT_EXT)])
+    return cat_list
+
+
+def load_catalog(storage, file_name, stats):  # IOError, CatalogFormatError
+    file_list = FileList()
+    hash_list = HashList()
+    with open_text(storage, file_name) as file_object:  # IOError
+        with stats.phase('catalog_read'):
+            file_list.load(file_object)  # CatalogFormatError
+            hash_list.load(file_object)  # CatalogFormatError
+        stats.count('catalog_read_bytes', file_object.buffer.tell())
+    if not catalog_complete(file_list, hash_list):
+        raise CatalogFormatError()
+    return file_list, hash_list
+
+
+# every file of catalogue has its object in HASH_LIST
+def catalog_complete(file_list, hash_list):
+    try:
+        for info in file_list.dict.values():
+            if (not info.isDir) and (hash_name(info) not in hash_list.dict):  # HashNameError
+                return False
+    except HashNameError:
+        return False
+    return True
+
+
+# write catalogue to temporary file and replace old catalogue by it
+def save_catalog(storage, file_name, file_list, hash_list, stats):  # IOError
+    with open_text(storage, file_name + STR_TMP_EXT, 'w') as file_object:  # IOError
+        with stats.phase('catalog_write'):
+            file_list.save(file_object)
+            hash_list.save(file_object)
+            file_object.flush()
+        stats.count('catalog_write_bytes', file_object.buffer.tell())
+    storage.sync(file_name + STR_TMP_EXT)  # IOError
+    storage.replace(file_name + STR_TMP_EXT, file_name)  # IOError
+
+
+# backup name -> {sha256.size: size} of objects used by files of catalogues
+def live_objects(catalogs):
+    live = {}
+    for (file_list, hash_list) in catalogs.values():
+        for info in file_list.dict.values():
+            if not info.isDir:
+                key = hash_name(info)
+                if key in hash_list.dict:
+                    live.setdefault(hash_list.dict[key], {})[key] = info.size
+    return live
+
+
+# remove from hash lists objects not used by any catalogue, returns names of changed catalogues
+def trim_hash_lists(catalogs, live):
+    changed = []
+    for name in sorted(catalogs):
+        hash_list = catalogs[name][1]
+        dead = [key for key in hash_list.dict if key not in live.get(hash_list.dict[key], {})]
+        for key in dead:
+            del hash_list.dict[key]
+        if dead:
+            changed.append(name)
+    return changed
+
+
+# remove volumes (all volumes of backups) and their indexes
+def remove_volumes(storage, path_list, stats):  # IOError
+    backups = set()
+    for path in path_list:
+        stats.count('removed_bytes', storage.size(path))
+        storage.remove(path)  # IOError
+        stats.count('removed_volumes')
+        backups.add(VOLUME_FILE_NAME.match(path).group(1))
+    for backup in sorted(backups):
+        if storage.exists(backup + STR_IDX_EXT):
+            storage.remove(backup + STR_IDX_EXT)  # IOError
+
+
+def sh_prune(sh_args, stats, storage):
+    # check repository
+    if not storage.is_valid():
+        print('ERROR: Repository not found!\n')
+        return 1
+    
+    # create must not run while catalogues and volumes are removed
+    if not sh_args.dry_run:
+        try:
+            if not lock_repository(storage):
+                return 1
+        except IOError:
+            print('ERROR: Can not create lock file: ' + REPOSITORY_LOCK)
+            return 1
+    try:
+        return prune_repository(sh_args, stats, storage)
+    finally:
+        if not sh_args.dry_run:
+            try:
+                storage.remove(REPOSITORY_LOCK)
+            except IOError:
+                print('WARNING: Can not remove lock file: ' + REPOSITORY_LOCK)
+
+
+def prune_repository(sh_args, stats, storage):
+    # catalogues to remove, without names only volumes without live objects are removed
+    names = catalog_list(storage)
+    retired = []
+    for name in names:
+        for mask in sh_args.name:
+            if fnmatch.fnmatch(name, mask) and (name not in retired):
+                retired.append(name)
+    if sh_args.name and (len(retired) == 0):
+        print('ERROR: No catalogue found!\n')
+        return 1
+    
+    # load kept catalogues
+    catalogs = {}
+    for name in names:
+        if name not in retired:
+            try:
+                catalogs[name] = load_catalog(storage, name + STR_CAT_EXT, stats)
+            except (IOError, CatalogFormatError):
+                print('ERROR: Can not read catalogue: ' + name + STR_CAT_EXT)
+                return 1
+    
+    # objects used by kept catalogues
+    live = live_objects(catalogs)
+    sets = volume_sets(storage)
+    dead_sets = [name for name in sorted(sets) if name not in live]
+    
+    if sh_args.dry_run or not sh_args.quiet:
+        for name in retired:
+            print('Catalogue: ' + name + STR_CAT_EXT)
+        for name in dead_sets:
+            print('Volumes: ' + name + ' (' + str(len(sets[name])) + ')')
+    if sh_args.dry_run:
+        return 0
+    
+    try:
+        # 1. kept catalogues don't reference removed objects any more
+        for name in trim_hash_lists(catalogs, live):
+            save_catalog(storage, name + STR_CAT_EXT,
+                         catalogs[name][0], catalogs[name][1], stats)
+        # 2. remove catalogues
+        for name in retired:
+            storage.remove(name + STR_CAT_EXT)
+            if storage.exists(name + STR_JNL_EXT):
+                storage.remove(name + STR_JNL_EXT)
+            stats.count('removed_catalogs')
+        # 3. remove volumes without live objects
+        for name in dead_sets:
+            remove_volumes(storage, sets[name], stats)
+    except (OSError, IOError) as e:
+        print('ERROR: Can not update repository: ' + str(e.filename))
+        return 1
+    
+    if not sh_args.quiet:
+        print('Catalogues (Removed/Kept): %s / %s, Volumes removed: %s, Size: %.02f Mb' % (
+              len(retired), len(catalogs), stats.get('removed_volumes'),
+              stats.get('removed_bytes')/1024.0/1024.0))
+    return 0
+
+
+# sha256.size -> stored size of all members in volumes
+def list_volume_members(storage, path_list, stats):  # IOError, tarfile.TarError
+    stored = {}
+    for path in path_list:
+        with storage.open_read(path) as volume_file:  # IOError
+            with tarfile.open(path, fileobj=StatsFile(volume_file, stats, 'volume_read')) as tar:
+                for member in tar.getmembers():  # tarfile.TarError
+                    stored[member.name] = stored.get(member.name, 0) + member.size
+    return stored
+
+
+# copy `objects` (sha256.size -> size) from volumes `path_list` to writer, returns names of copied objects
+def copy_objects(storage, path_list, objects, writer, stats):  # IOError, tarfile.TarError
+    copied = set()
+    spool = None  # pieces of split object
+    spool_info = None
+    for path in path_list:
+        with storage.open_read(path) as volume_file:  # IOError
+            stream = volume_stream(StatsFile(volume_file, stats, 'volume_read'), VOLUME_FILE_NAME.match(path).group(3))
+            with tarfile.open(path, 'r|', fileobj=stream) as tar:
+                for member in tar:  # tarfile.TarError
+                    if (member.name not in objects) or (member.name in copied) or (not member.isfile()):
+                        continue
+                    if (spool is not None) and (member.name != spool_info.name):
+                        # rest of split object is lost
+                        spool.close()
+                        spool = None
+                    if (spool is None) and (member.size == objects[member.name]):
+                        writer.add_object(tar.extractfile(member), member)
+                        copied.add(member.name)
+                        continue
+                    if spool is None:
+                        spool = tempfile.TemporaryFile()
+                        spool_info = copy.copy(member)
+                    shutil.copyfileobj(tar.extractfile(member), spool)
+                    if spool.tell() == objects[member.name]:
+                        spool.seek(0, os.SEEK_SET)
+                        spool_info.size = objects[member.name]
+                        writer.add_object(spool, spool_info)
+                        copied.add(member.name)
+                        spool.close()
+                        spool = None
+    if spool is not None:
+        spool.close()
+    return copied
+
+
+def sh_compact(sh_args, stats, storage):
+    # check repository
+    if not storage.is_valid():
+        print('ERROR: Repository not found!\n')
+        return 1
+    
+    # create must not run while volumes are rewritten
+    if not sh_args.dry_run:
+        try:
+            if not lock_repository(storage):
+                return 1
+        except IOError:
+            print('ERROR: Can not create lock file: ' + REPOSITORY_LOCK)
+            return 1
+    try:
+        return compact_repository(sh_args, stats, storage)
+    finally:
+        if not sh_args.dry_run:
+            try:
+                storage.remove(REPOSITORY_LOCK)
+            except IOError:
+                print('WARNING: Can not remove lock file: ' + REPOSITORY_LOCK)
+
+
+def compact_repository(sh_args, stats, storage):
+    # load all catalogues
+    names = catalog_list(storage)
+    catalogs = {}
+    for name in names:
+        try:
+            catalogs[name] = load_catalog(storage, name + STR_CAT_EXT, stats)
+        except (IOError, CatalogFormatError):
+            print('ERROR: Can not read catalogue: ' + name + STR_CAT_EXT)
+            return 1
+    
+    live = live_objects(catalogs)
+    sets = volume_sets(storage)
+    
+    # hash lists don't reference objects that will be removed
+    if not sh_args.dry_run:
+        try:
+            for name in trim_hash_lists(catalogs, live):
+                save_catalog(storage, name + STR_CAT_EXT,
+                             catalogs[name][0], catalogs[name][1], stats)
+        except (OSError, IOError):
+            print('ERROR: Can not update catalogue: ' + name + STR_CAT_EXT)
+            return 1
+    
+    result = 0
+    for backup in sorted(sets):
+        objects = live.get(backup, {})
+        try:
+            with stats.phase('list'):
+                stored = list_volume_members(storage, sets[backup], stats)
+        except (IOError, tarfile.TarError):
+            print('ERROR: Can not read volumes: ' + backup)
+            result = 1
+            continue
+        stored_size = sum(stored.values())
+        live_size = sum([stored.get(key, 0) for key in objects])
+        if [key for key in objects if stored.get(key) != objects[key]]:
+            print('ERROR: Live objects are missing or damaged in volumes: ' + backup)
+            result = 1
+            continue
+        if (stored_size > 0) and (live_size * 100 >= stored_size * sh_args.threshold):
+            continue
+        if not sh_args.quiet:
+            print('Volumes: %s (%s), Size (Live/All): %.02f Mb / %.02f Mb' % (
+                  backup, len(sets[backup]), live_size/1024.0/1024.0, stored_size/1024.0/1024.0))
+        if sh_args.dry_run:
+            continue
+        
+        try:
+            if len(objects) == 0:
+                remove_volumes(storage, sets[backup], stats)
+                continue
+            
+            # name of new volumes
+            base = backup.split(STR_PACK)[0]
+            number = 1
+            while (base + STR_PACK + str(number) in sets) or (base + STR_PACK + str(number) in catalogs):
+                number += 1
+            pack = base + STR_PACK + str(number)
+            sets[pack] = []
+            
+            # 1. copy live objects to new volumes
+            compr = sh_args.compression
+            if compr is None:
+                compr = {STR_TAR_EXT: 'tar', STR_GZ_EXT: 'gz', STR_BZ2_EXT: 'bz2'}[
+                    VOLUME_FILE_NAME.match(sets[backup][0]).group(3)]
+            writer = TarFileWriter(pack, sh_args.size, compr, stats, storage=storage)
+            try:
+                with stats.phase('copy'):
+                    copied = copy_objects(storage, sets[backup], objects, writer, stats)
+            finally:
+                writer.close()
+            storage.flush()
+            pack_volumes = volume_list(storage, pack)
+            if len(copied) != len(objects):
+                print('ERROR: Can not copy all live objects: ' + backup)
+                remove_volumes(storage, pack_volumes, Stats())
+                result = 1
+                continue
+            for path in pack_volumes:
+                storage.sync(path)
+            
+            # 2. catalogues reference new volumes
+            for name in sorted(catalogs):
+                hash_list = catalogs[name][1]
+                keys = [key for key in hash_list.dict if hash_list.dict[key] == backup]
+                if keys:
+                    for key in keys:
+                        hash_list.dict[key] = pack
+                    save_catalog(storage, name + STR_CAT_EXT,
+                                 catalogs[name][0], hash_list, stats)
+            
+            # 3. remove old volumes
+            remove_volumes(storage, sets[backup], stats)
+            stats.count('packed_volumes', len(pack_volumes))
+            stats.count('packed_bytes', live_size)
+        except (OSError, IOError, tarfile.TarError) as e:
+            print('ERROR: Can not compact volumes: ' + backup + ' (' + str(e) + ')')
+            return 1
+    
+    if not sh_args.quiet:
+        print('Volumes (Removed/Created): %s / %s, Size (Removed/Copied): %.02f Mb / %.02f Mb' % (
+              stats.get('removed_volumes'), stats.get('packed_volumes'),
+              stats.get('removed_bytes')/1024.0/1024.0, stats.get('packed_bytes')/1024.0/1024.0))
+    return result
+
+
+# index of backup volumes, volumes are read if there is no index file
+def load_index(storage, backup, stats):  # IOError, tarfile.TarError
+    index = VolumeIndex()
+    with stats.phase('index'):
+        if storage.exists(backup + STR_IDX_EXT):
+            try:
+                with open_text(storage, backup + STR_IDX_EXT) as file_object:  # IOError
+                    index.load(file_object)  # CatalogFormatError
+                return index
+            except CatalogFormatError:
+                # stdout can be output of cat
+                print('WARNING: Index of volumes is damaged, volumes are read: ' + backup + STR_IDX_EXT,
+                      file=sys.stderr)
+        index.scan(storage, volume_list(storage, backup), stats)
+    return index
+
+
+# reader of object pieces from volumes of one backup (see VolumeIndex)
+# pieces are read in order of volumes: one range request per volume, gaps are read through,
+# request / decompression is restarted at a chunk only if at least CHUNK_SIZE is skipped
+class VolumeReader():  # IOError
+    def __init__(self, storage, backup, index, stats):
+        self.storage = storage
+        self.index = index
+        self.stats = stats
+        self.backup = backup
+        self.volumes = {}  # volume number -> file name, other volumes can be read if one is missing
+        for f in storage.list():  # IOError
+            m = VOLUME_FILE_NAME.match(f)
+            if (m is not None) and (m.group(1) == backup):
+                self.volumes[int(m.group(2))] = f
+        self.needed = {}  # volume number -> [tar offset of first needed byte, tar offset after last one]
+        self.order = []  # volume numbers in order of reading
+        self.number = None  # volume of open stream
+        self.stream = None
+        self.position = 0  # tar offset of stream
+        self.end = None  # tar offset where range of stream ends, None - end of volume
+    
+    # piece which will be read: range requests end after last needed piece of volume
+    def need(self, number, offset, size):
+        if number not in self.needed:
+            self.order.append(number)
+            self.needed[number] = [offset, offset + size]
+        else:
+            self.needed[number][0] = min(self.needed[number][0], offset)
+            self.needed[number][1] = max(self.needed[number][1], offset + size)
+    
+    def _range(self, number, offset, end):
+        # (tar offset of start, file offset of start, file offset of end, tar offset of end) of range request
+        chunks = self.index.chunks.get(number)
+        if chunks is None:
+            return offset, offset, end, end
+        # decompression starts at the last chunk before offset, stops at the first chunk after range
+        i = bisect.bisect_right(chunks, (offset, float('inf'))) - 1
+        if end is None:
+            return chunks[i][0], chunks[i][1], None, None
+        j = bisect.bisect_left(chunks, (end, 0))
+        if j < len(chunks):
+            return chunks[i][0], chunks[i][1], chunks[j][1], chunks[j][0]
+        return chunks[i][0], chunks[i][1], None, None
+    
+    def _path(self, number):  # IOError
+        if number not in self.volumes:
+            raise IOError('Volume not found: ' + self.backup + STR_POINT + str(number))
+        return self.volumes[number]
+    
+    def _prefetch(self, number):
+        # next volume is downloaded in background if most of it will be read
+        # only a hint: missing next volume is reported when it is read
+        k = self.order.index(number) + 1 if number in self.order else len(self.order)
+        if (k < len(self.order)) and (self.order[k] in self.volumes):
+            path = self.volumes[self.order[k]]
+            try:
+                size = self.storage.size(path)  # IOError
+            except IOError:
+                return
+            (start, file_start, file_end, end) = self._range(self.order[k], *self.needed[self.order[k]])
+            if (size if file_end is None else file_end) - file_start >= size // 2:
+                self.storage.prefetch(path)
+    
+    def _open(self, number, offset, length):  # IOError
+        self.close()
+        end = None
+        if number in self.needed:
+            end = max(self.needed[number][1], offset + length)
+        path = self._path(number)
+        (start, file_start, file_end, self.end) = self._range(number, offset, end)
+        self._prefetch(number)
+        volume_file = StatsFile(self.storage.open_range(path, file_start, file_end), self.stats, 'volume_read')
+        self.stream = volume_stream(volume_file, VOLUME_FILE_NAME.match(path).group(3))
+        self.number = number
+        self.position = start
+    
+    # copy `length` bytes from tar offset `offset` of volume to destination
+    def copy(self, number, offset, length, destination):  # IOError
+        if (self.number != number) or (offset < self.position) or \
+                ((self.end is not None) and (offset + length > self.end)) or \
+                (self._range(number, offset, None)[0] - self.position >= CHUNK_SIZE):
+            self._open(number, offset, length)
+        skip = offset - self.position
+        self.stats.count('skipped_bytes', skip)
+        while (skip > 0) or (length > 0):
+            if skip > 0:
+                data = self.stream.read(min(skip, COPY_BUFFER_SIZE))
+                skip -= len(data)
+            else:
+                data = self.stream.read(min(length, COPY_BUFFER_SIZE))
+                length -= len(data)
+                destination.write(data)
+            if not data:
+                self.close()
+                raise IOError('Unexpected end of volume: ' + self._path(number))
+            self.position += len(data)
+    
+    def close(self):  # IOError
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+            self.number = None
+
+
+def sh_cat(sh_args, stats, storage):
+    # stdout is used for data: messages are written to stderr
+    # check repository
+    if not storage.is_valid():
+        print('ERROR: Repository not found!\n', file=sys.stderr)
+        return 1
+    
+    # check existence of catalogue file
+    if not storage.exists(sh_args.name + STR_CAT_EXT):
+        print('ERROR: Catalogue not found!\n', file=sys.stderr)
+        return 1
+    
+    try:
+        (file_list, hash_list) = load_catalog(storage, sh_args.name + STR_CAT_EXT, stats)
+    except (IOError, CatalogFormatError):
+        print('ERROR: Can not read catalogue: ' + sh_args.name + STR_CAT_EXT, file=sys.stderr)
+        return 1
+    
+    # file and its object
+    path = sh_args.path if sh_args.path.startswith(STR_SLASH) else STR_SLASH + sh_args.path
+    info = file_list.dict.get(path)
+    if (info is None) or info.isDir:
+        print('ERROR: File not found in catalogue: ' + path, file=sys.stderr)
+        return 1
+    key = hash_name(info)
+    backup = hash_list.dict.get(key)
+    if backup is None:
+        print('ERROR: Object not found in catalogue: ' + key, file=sys.stderr)
+        return 1
+    if (sh_args.offset < 0) or (sh_args.offset > info.size):
+        print('ERROR: Offset is out of file: ' + str(info.size), file=sys.stderr)
+        return 1
+    length = info.size - sh_args.offset
+    if (sh_args.length is not None) and (sh_args.length < length):
+        length = max(0, sh_args.length)
+    
+    destination = sys.stdout.buffer
+    try:
+        index = load_index(storage, backup, stats)
+        pieces = sorted(index.members.get(key, []))
+        if sum([size for (volume, offset, size) in pieces]) != info.size:
+            print('ERROR: Object not found in volumes: ' + backup + ': ' + key, file=sys.stderr)
+            return 1
+        reader = VolumeReader(storage, backup, index, stats)
+        # copy intersection of range with every piece of object
+        ranges = []
+        position = 0
+        for (volume, offset, size) in pieces:
+            first = max(sh_args.offset, position)
+            last = min(sh_args.offset + length, position + size)
+            if first < last:
+                ranges.append((volume, offset + first - position, last - first))
+                reader.need(*ranges[-1])
+            position += size
+        with stats.phase('extract'):
+            try:
+                for (volume, offset, size) in ranges:
+                    reader.copy(volume, offset, size, destination)
+            finally:
+                reader.close()
+            destination.flush()
+    except BrokenPipeError:
+        # reader of output has finished (`| head`)
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 0
+    except IndexError:
+        print('ERROR: Index of volumes is damaged: ' + backup + STR_IDX_EXT, file=sys.stderr)
+        return 1
+    except (IOError, tarfile.TarError) as e:
+        print('ERROR: Can not read volumes: ' + backup + ' (' + str(e) + ')', file=sys.stderr)
+        return 1
+    stats.count('output_bytes', length)
+    return 0
+
+
+# (key, old value or None, new value or None) of two iterators of (key, value) sorted by key
+def merge_join(old, new):  # CatalogFormatError
+    old_item = next(old, None)
+    new_item = next(new, None)
+    last_key = None
+    while (old_item is not None) or (new_item is not None):
+        if (new_item is None) or ((old_item is not None) and (old_item[0] < new_item[0])):
+            (key, item) = (old_item[0], (old_item[0], old_item[1], None))
+            old_item = next(old, None)
+        elif (old_item is None) or (new_item[0] < old_item[0]):
+            (key, item) = (new_item[0], (new_item[0], None, new_item[1]))
+            new_item = next(new, None)
+        else:
+            (key, item) = (old_item[0], (old_item[0], old_item[1], new_item[1]))
+            old_item = next(old, None)
+            new_item = next(new, None)
+        # catalogues are always saved sorted
+        if (last_key is not None) and (key <= last_key):
+            raise CatalogFormatError()
+        last_key = key
+        yield item
+
+
+def match_masks(key, include, exclude):
+    if include and not [mask for mask in include if fnmatch.fnmatch(key, mask)]:
+        return False
+    if exclude and [mask for mask in exclude if fnmatch.fnmatch(key, mask)]:
+        return False
+    return True
+
+
+def sh_diff(sh_args, stats, storage):
+    # check repository
+    if not storage.is_valid():
+        print('ERROR: Repository not found!\n')
+        return 1
+    
+    # check existence of catalogue files
+    for name in (sh_args.old, sh_args.new):
+        if not storage.exists(name + STR_CAT_EXT):
+            print('ERROR: Catalogue not found: ' + name + STR_CAT_EXT)
+            return 1
+    
+    # A - added, D - deleted, M - modified (data), T - touched (date-time only)
+    count = {'A': 0, 'D': 0, 'M': 0, 'T': 0, 'U': 0}  # U - unchanged
+    size = {'A': 0, 'D': 0, 'M': 0}
+    dirs = {'A': 0, 'D': 0}
+    objects = 0
+    objects_size = 0
+    try:
+        with open_text(storage, sh_args.old + STR_CAT_EXT) as old_file, \
+                open_text(storage, sh_args.new + STR_CAT_EXT) as new_file:  # IOError
+            # files and dirs: both DIR_LIST sections are read once, side by side
+            with stats.phase('diff'):
+                for (key, old, new) in merge_join(dir_list_entries(old_file), dir_list_entries(new_file)):
+                    stats.count('entries')
+                    if not match_masks(key, sh_args.include, sh_args.exclude):
+                        continue
+                    if (old is not None) and (new is not None) and (old.isDir != new.isDir):
+                        # file replaced by dir or vice versa
+                        changes = [('D', old), ('A', new)]
+                    elif new is None:
+                        changes = [('D', old)]
+                    elif old is None:
+                        changes = [('A', new)]
+                    elif old.isDir:
+                        continue
+                    elif (old.hash != new.hash) or (old.size != new.size):
+                        changes = [('M', new)]
+                    elif old.mtime != new.mtime:
+                        changes = [('T', new)]
+                    else:
+                        count['U'] += 1
+                        continue
+                    for (change, info) in changes:
+                        if info.isDir:
+                            dirs[change] += 1
+                        else:
+                            count[change] += 1
+                            if change in size:
+                                size[change] += info.size
+                        if not (sh_args.summary or sh_args.json):
+                            with stats.phase('output'):
+                                print(change + ' ' + key + (STR_SLASH if info.isDir else STR_EMPTY))
+            
+            # objects: HASH_LIST sections follow DIR_LIST sections
+            with stats.phase('diff'):
+                for (key, old, new) in merge_join(hash_list_entries(old_file), hash_list_entries(new_file)):
+                    if old is None:
+                        objects += 1
+                        objects_size += split_hash_name(key)[1]  # HashNameError
+            stats.count('catalog_read_bytes', old_file.buffer.tell() + new_file.buffer.tell())
+    except IOError:
+        print('ERROR: Can not read catalogues!')
+        return 1
+    except (CatalogFormatError, HashNameError, ValueError):
+        print('ERROR: Catalogue is damaged or not sorted!')
+        return 1
+    
+    for change in count:
+        stats.count('files_' + {'A': 'added', 'D': 'deleted', 'M': 'modified', 'T': 'touched',
+                                'U': 'unchanged'}[change], count[change])
+    stats.count('objects_new', objects)
+    stats.count('objects_new_size', objects_size)
+    if sh_args.json:
+        json.dump({'old': sh_args.old, 'new': sh_args.new,
+                   'files': {'added': count['A'], 'deleted': count['D'], 'modified': count['M'],
+                             'touched': count['T'], 'unchanged': count['U']},
+                   'size': {'added': size['A'], 'deleted': size['D'], 'modified': size['M']},
+                   'dirs': {'added': dirs['A'], 'deleted': dirs['D']},
+                   'objects': {'new': objects, 'size': objects_size}}, sys.stdout, sort_keys=True)
+        sys.stdout.write(STR_EOL)
+    elif not sh_args.quiet:
+        print('Files (Added/Deleted/Modified/Touched/Unchanged): %s / %s / %s / %s / %s, Dirs (Added/Deleted): %s / %s' % (
+              count['A'], count['D'], count['M'], count['T'], count['U'], dirs['A'], dirs['D']))
+        print('Size (Added/Deleted/Modified): %.02f Mb / %.02f Mb / %.02f Mb, New objects: %s, Size: %.02f Mb' % (
+              size['A']/1024.0/1024.0, size['D']/1024.0/1024.0, size['M']/1024.0/1024.0,
+              objects, objects_size/1024.0/1024.0))
+    return 0
+
+
+def sh_serve(sh_args, stats, storage):
+    # check repository
+    if not isinstance(storage, LocalStorage) or not storage.is_valid():
+        print('ERROR: Repository not found!\n')
+        return 1
+    
+    server = http.server.ThreadingHTTPServer((sh_args.host, sh_args.port), RepositoryHandler)
+    server.storage = storage
+    server.latency = sh_args.latency / 1000.0
+    server.verbose = sh_args.verbose
+    if not sh_args.quiet:
+        print('Serving %s at http://%s:%s/' % (sh_args.repository, sh_args.host, server.server_address[1]))
+        sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+def run_command(sh_args):
+    stats = Stats(sh_args.func.__name__[len('sh_'):])
+    storage = open_storage(sh_args.repository, getattr(sh_args, 'io_threads', 0))
+    try:
+        if getattr(sh_args, 'profile', None) is not None:
+            profiler = cProfile.Profile()
+            result = profiler.runcall(sh_args.func, sh_args, stats, storage)
+            try:
+                profiler.dump_stats(sh_args.profile)
+            except IOError:
+                print('ERROR: Can not write profile file!')
+        else:
+            result = sh_args.func(sh_args, stats, storage)
+    finally:
+        # wait for background writes
+        try:
+            storage.close()
+        except IOError as e:
+            print('ERROR: Can not write to repository: ' + str(e))
+            result = 1
+    if getattr(sh_args, 'stats', None) is not None:
+        stats.save_file(sh_args.stats, sh_args.stats_file)
+    return result
+
+
+def positive_float(value):  # argparse.ArgumentTypeError
+    try:
+        number = float(value)
+    except ValueError:
+        number = 0.0
+    if not number > 0:
+        raise argparse.ArgumentTypeError("'%s' is not a positive number" % value)
+    return number
+
+
+def positive_int(value):  # argparse.ArgumentTypeError
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+    if number <= 0:
+        raise argparse.ArgumentTypeError("'%s' is not a positive integer" % value)
+    return number
+
+
 # source - папка, которая архивируется
 # destination - папка, в которую извлекается
 # repository - папка в которой хранится архив
@@ -832,7 +3373,7 @@ subparsers = parser.add_subparsers()
 
 parser_create = subparsers.add_parser('create')  #
 parser_create.add_argument('source', help='Directory tree that will be backed up.')  # dir
-parser_create.add_argument('repository', help='Directory in which backup will be stored.')  # dir
+parser_create.add_argument('repository', help='Directory or URL in which backup will be stored.')  # dir
 parser_create.add_argument('name', help='Basename for backup.')  # name
 parser_create.add_argument('-r', '--reference',
                            help='Reference basename for differential backup. '
@@ -849,10 +3390,30 @@ parser_create.add_argument('-g', '--ignore', action='store_true', help='Ignore a
 parser_create.add_argument('-c', '--compression', help="'tar'-default, 'gz' or 'bz2'")
 parser_create.add_argument('-a', '--recalculate', action='store_true',
                            help="Recalculate all hashes again. Don't use hashes from reference.")
+parser_create.add_argument('-f', '--fast', action='store_true',
+                           help="Don't list directories not changed since reference backup (mtime) "
+                                "and don't check their files. Uses journal of reference.")
+parser_create.add_argument('--read-limit', type=positive_float,
+                           help='Maximum read speed (Mb/s) for source files.')
+parser_create.add_argument('--write-limit', type=positive_float,
+                           help='Maximum write speed (Mb/s) for volume files (compressed data for gz / bz2).')
+parser_create.add_argument('--adaptive', action='store_true',
+                           help='Reduce read / write limits while system I/O pressure is high (Linux).')
+parser_create.add_argument('--nice', type=int, help='Increase CPU niceness by this value.')
+parser_create.add_argument('--ionice',
+                           help="I/O priority: 'idle' or 'best-effort[:level]' (level 0-7), Linux only.")
+parser_create.add_argument('-b', '--background', action='store_true',
+                           help="Low priority mode: '--nice 19 --ionice idle' unless specified.")
+parser_create.add_argument('--stats', choices=['text', 'json'],
+                           help='Print time of every phase, counters and volume throughput.')
+parser_create.add_argument('--stats-file', help='Write statistics to file instead of stdout.')
+parser_create.add_argument('--profile', help='Run with cProfile and save profile to file.')
+parser_create.add_argument('--io-threads', type=int, default=0,
+                           help='Number of parallel repository reads / writes (remote repositories). Default: 0 - sequential.')
 parser_create.set_defaults(func=sh_create)
 
 parser_find = subparsers.add_parser('find')  # simple regular expressions
-parser_find.add_argument('repository', help='Directory in which backup is stored.')  # dir
+parser_find.add_argument('repository', help='Directory or URL in which backup is stored.')  # dir
 parser_find.add_argument('name', help='Mask for backup basename. '
                                       'Several backups can be looked thorough.')  # name pattern (without ext)
 parser_find.add_argument('-i', '--include', nargs='*',
@@ -860,10 +3421,16 @@ parser_find.add_argument('-i', '--include', nargs='*',
                               'If no mask specified all Files/Dirs will be shown.')
 parser_find.add_argument('-e', '--exclude', nargs='*',
                          help='Mask list. Files/Dirs matching at least one mask will not be shown.')
+parser_find.add_argument('--stats', choices=['text', 'json'],
+                         help='Print time of every phase, counters and volume throughput.')
+parser_find.add_argument('--stats-file', help='Write statistics to file instead of stdout.')
+parser_find.add_argument('--profile', help='Run with cProfile and save profile to file.')
+parser_find.add_argument('--io-threads', type=int, default=0,
+                         help='Number of parallel repository reads / writes (remote repositories). Default: 0 - sequential.')
 parser_find.set_defaults(func=sh_find)
 
 parser_restore = subparsers.add_parser('restore')  # restore backup
-parser_restore.add_argument('repository', help='Directory in which backup is stored.')  # dir
+parser_restore.add_argument('repository', help='Directory or URL in which backup is stored.')  # dir
 parser_restore.add_argument('name', help='Basename for backup to be restored.')  # name
 parser_restore.add_argument('destination', help='Directory which will be restored.')  # dir
 parser_restore.add_argument('-i', '--include', nargs='*',
@@ -873,11 +3440,114 @@ parser_restore.add_argument('-e', '--exclude', nargs='*',
                             help='Mask list. Files/Dirs matching at least one mask will not be restored.')
 parser_restore.add_argument('-d', '--delete', action='store_true',
                             help='Delete Files/Dirs not existing in backup.')
+parser_restore.add_argument('-q', '--quiet', action='store_true',
+                            help='Nothing is displayed if operation succeeds.')
 parser_restore.add_argument('-g', '--ignore', action='store_true', help='Ignore all errors.')
+parser_restore.add_argument('--stats', choices=['text', 'json'],
+                            help='Print time of every phase, counters and volume throughput.')
+parser_restore.add_argument('--stats-file', help='Write statistics to file instead of stdout.')
+parser_restore.add_argument('--profile', help='Run with cProfile and save profile to file.')
+parser_restore.add_argument('--io-threads', type=int, default=0,
+                            help='Number of parallel repository reads / writes (remote repositories). Default: 0 - sequential.')
 parser_restore.set_defaults(func=sh_restore)
 
-args = parser.parse_args()
-args.func(args)
+parser_verify = subparsers.add_parser('verify')  # check volumes
+parser_verify.add_argument('repository', help='Directory or URL in which backup is stored.')  # dir
+parser_verify.add_argument('name', help='Basename for backup to be checked.')  # name
+parser_verify.add_argument('-j', '--jobs', type=positive_int,
+                           help='Number of backups checked in parallel. Default: number of CPUs.')
+parser_verify.add_argument('-p', '--sample', type=positive_int,
+                           help='Check random sample of volumes only (percent of volumes).')
+parser_verify.add_argument('--seed', type=int, help='Random seed for --sample.')
+parser_verify.add_argument('-q', '--quiet', action='store_true',
+                           help='Nothing is displayed if operation succeeds.')
+parser_verify.add_argument('--stats', choices=['text', 'json'],
+                           help='Print time of every phase, counters and volume throughput.')
+parser_verify.add_argument('--stats-file', help='Write statistics to file instead of stdout.')
+parser_verify.add_argument('--profile', help='Run with cProfile and save profile to file.')
+parser_verify.add_argument('--io-threads', type=int, default=0,
+                           help='Number of parallel repository reads / writes (remote repositories). Default: 0 - sequential.')
+parser_verify.set_defaults(func=sh_verify)
+
+parser_prune = subparsers.add_parser('prune')  # remove backups
+parser_prune.add_argument('repository', help='Directory or URL in which backups are stored.')  # dir
+parser_prune.add_argument('name', nargs='*', help='Masks for basenames of backups to be removed. '
+                                                  'Without masks only unused volumes are removed.')  # name patterns
+parser_prune.add_argument('-n', '--dry-run', action='store_true', help='Only show what would be removed.')
+parser_prune.add_argument('-q', '--quiet', action='store_true',
+                          help='Nothing is displayed if operation succeeds.')
+parser_prune.add_argument('--stats', choices=['text', 'json'],
+                          help='Print time of every phase, counters and volume throughput.')
+parser_prune.add_argument('--stats-file', help='Write statistics to file instead of stdout.')
+parser_prune.add_argument('--profile', help='Run with cProfile and save profile to file.')
+parser_prune.add_argument('--io-threads', type=int, default=0,
+                          help='Number of parallel repository reads / writes (remote repositories). Default: 0 - sequential.')
+parser_prune.set_defaults(func=sh_prune)
+
+parser_compact = subparsers.add_parser('compact')  # rewrite volumes with few live objects
+parser_compact.add_argument('repository', help='Directory or URL in which backups are stored.')  # dir
+parser_compact.add_argument('-t', '--threshold', type=int, default=50,
+                            help='Volumes are rewritten if live objects take less than this percent. Default: 50.')
+parser_compact.add_argument('-s', '--size', type=int, default=1024*1024*1020, help='Size of one slice.')
+parser_compact.add_argument('-c', '--compression',
+                            help="'tar', 'gz' or 'bz2'. Default: compression of rewritten volumes.")
+parser_compact.add_argument('-n', '--dry-run', action='store_true', help='Only show what would be rewritten.')
+parser_compact.add_argument('-q', '--quiet', action='store_true',
+                            help='Nothing is displayed if operation succeeds.')
+parser_compact.add_argument('--stats', choices=['text', 'json'],
+                            help='Print time of every phase, counters and volume throughput.')
+parser_compact.add_argument('--stats-file', help='Write statistics to file instead of stdout.')
+parser_compact.add_argument('--profile', help='Run with cProfile and save profile to file.')
+parser_compact.add_argument('--io-threads', type=int, default=0,
+                            help='Number of parallel repository reads / writes (remote repositories). Default: 0 - sequential.')
+parser_compact.set_defaults(func=sh_compact)
+
+parser_cat = subparsers.add_parser('cat')  # write file or its part to stdout
+parser_cat.add_argument('repository', help='Directory or URL in which backup is stored.')  # dir
+parser_cat.add_argument('name', help='Basename for backup.')  # name
+parser_cat.add_argument('path', help='Path of file in backup: /dir/file.txt')
+parser_cat.add_argument('-o', '--offset', type=int, default=0, help='First byte of file to write. Default: 0.')
+parser_cat.add_argument('-l', '--length', type=int, help='Number of bytes to write. Default: up to the end of file.')
+parser_cat.add_argument('--stats', choices=['text', 'json'],
+                        help='Print time of every phase, counters and volume throughput.')
+parser_cat.add_argument('--stats-file', help='Write statistics to file instead of stdout.')
+parser_cat.add_argument('--profile', help='Run with cProfile and save profile to file.')
+parser_cat.add_argument('--io-threads', type=int, default=0,
+                        help='Number of parallel repository reads / writes (remote repositories). Default: 0 - sequential.')
+parser_cat.set_defaults(func=sh_cat)
+
+parser_diff = subparsers.add_parser('diff')  # changes between two backups
+parser_diff.add_argument('repository', help='Directory or URL in which backups are stored.')  # dir
+parser_diff.add_argument('old', help='Basename of old backup.')  # name
+parser_diff.add_argument('new', help='Basename of new backup.')  # name
+parser_diff.add_argument('-i', '--include', nargs='*',
+                         help='Mask list. Only Files/Dirs matching at least one mask are compared.')
+parser_diff.add_argument('-e', '--exclude', nargs='*',
+                         help='Mask list. Files/Dirs matching at least one mask are not compared.')
+parser_diff.add_argument('-s', '--summary', action='store_true', help='Show summary only, without list of changes.')
+parser_diff.add_argument('-j', '--json', action='store_true', help='Show summary only, as json.')
+parser_diff.add_argument('-q', '--quiet', action='store_true', help='Show list of changes only, without summary.')
+parser_diff.add_argument('--stats', choices=['text', 'json'],
+                         help='Print time of every phase, counters and volume throughput.')
+parser_diff.add_argument('--stats-file', help='Write statistics to file instead of stdout.')
+parser_diff.add_argument('--profile', help='Run with cProfile and save profile to file.')
+parser_diff.add_argument('--io-threads', type=int, default=0,
+                         help='Number of parallel repository reads / writes (remote repositories). Default: 0 - sequential.')
+parser_diff.set_defaults(func=sh_diff)
+
+parser_serve = subparsers.add_parser('serve')  # http server for repository
+parser_serve.add_argument('repository', help='Directory in which backups are stored.')  # dir
+parser_serve.add_argument('--host', default='127.0.0.1', help='Address to listen on. Default: 127.0.0.1.')
+parser_serve.add_argument('-p', '--port', type=int, default=8080, help='Port to listen on. Default: 8080.')
+parser_serve.add_argument('--latency', type=int, default=0,
+                          help='Delay of every request (ms), to simulate remote storage.')
+parser_serve.add_argument('-v', '--verbose', action='store_true', help='Log every request.')
+parser_serve.add_argument('-q', '--quiet', action='store_true', help='Do not show server address.')
+parser_serve.set_defaults(func=sh_serve)
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    sys.exit(run_command(args))
 
 # // целочисленное деление, результат – целое число (дробная часть отбрасывается)
 # % деление по модулю
@@ -0,0 +1,610 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# ==============================================================================
+#
+# MIT License
+# http://opensource.org/licenses/MIT
+# Copyright (c) 2015 Denys Orlenko
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+# Except as contained in this notice, the name(s) of the above copyright holders
+# shall not be used in advertising or otherwise to promote the sale, use or
+# other dealings in this Software without prior written authorization.
+#
+# ==============================================================================
+
+# benchmark suite for siddar.py
+# every measurement runs in a separate child process, so peak RSS and
+# syscall counters belong to one subcommand / one core class benchmark only
+
+import os
+import os.path
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+import ast
+
+STR_SLASH = '/'
+STR_EOL = '\n'
+
+MB = 1024 * 1024
+BASE_MTIME = 1400000000  # fixed mtime of generated files (reproducible incremental runs)
+
+SIDDAR_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'siddar.py')
+
+
+def is_command_line(node):
+    # module level "args = parser.parse_args()" / "args.func(args)" of versions without __main__ guard
+    for call in ast.walk(node):
+        if isinstance(call, ast.Call) and isinstance(call.func, ast.Attribute) and \
+                (call.func.attr in ('parse_args', 'func')):
+            return True
+    return False
+
+
+def load_siddar(siddar_path):
+    # old siddar.py parses sys.argv and runs a command when imported,
+    # so its module level command line statements are not executed
+    with open(siddar_path, encoding='utf-8') as f:
+        tree = ast.parse(f.read(), siddar_path)
+    tree.body = [node for node in tree.body if not (isinstance(node, (ast.Assign, ast.Expr)) and
+                                                    is_command_line(node))]
+    module = type(sys)('siddar')
+    module.__file__ = siddar_path
+    exec(compile(tree, siddar_path, 'exec'), module.__dict__)
+    return module
+
+
+# ------------------------------------------------------------------------------
+# synthetic trees
+# ------------------------------------------------------------------------------
+
+class TreeGenerator:
+    def __init__(self, root, seed):
+        self.Root = root
+        self.Rnd = random.Random(seed)
+        self.Files = 0
+        self.Dirs = 0
+        self.Bytes = 0
+        self.Paths = []  # relative paths of generated files
+
+    def content(self, size):
+        return self.Rnd.randbytes(size)
+
+    def write(self, rel_path, data, mtime=BASE_MTIME):
+        full_path = self.Root + rel_path
+        d = os.path.dirname(full_path)
+        if not os.path.isdir(d):
+            os.makedirs(d)
+            self.Dirs += 1
+        with open(full_path, 'wb') as f:
+            f.write(data)
+        os.utime(full_path, (mtime, mtime))
+        self.Files += 1
+        self.Bytes += len(data)
+        self.Paths.append(rel_path)
+
+    def write_large(self, rel_path, size, chunk=4*MB):
+        full_path = self.Root + rel_path
+        d = os.path.dirname(full_path)
+        if not os.path.isdir(d):
+            os.makedirs(d)
+            self.Dirs += 1
+        with open(full_path, 'wb') as f:
+            left = size
+            while left > 0:
+                n = min(chunk, left)
+                f.write(self.content(n))
+                left -= n
+        os.utime(full_path, (BASE_MTIME, BASE_MTIME))
+        self.Files += 1
+        self.Bytes += size
+        self.Paths.append(rel_path)
+
+    def fix_dir_times(self):
+        for d, dirs, files in os.walk(self.Root):
+            os.utime(d, (BASE_MTIME, BASE_MTIME))
+
+    def info(self):
+        return {'files': self.Files, 'dirs': self.Dirs, 'bytes': self.Bytes}
+
+
+def gen_small(gen, scale):
+    # many small files in a flat-ish hierarchy
+    count = max(1, int(4000 * scale))
+    for i in range(count):
+        gen.write('/d%03d/f%06d.txt' % (i % 64, i), gen.content(gen.Rnd.randint(0, 4096)))
+
+
+def gen_huge(gen, scale):
+    # few huge files, larger than one volume
+    size = max(MB, int(48 * MB * scale))
+    for i in range(3):
+        gen.write_large('/huge/file%d.bin' % i, size + gen.Rnd.randint(0, MB))
+
+
+def gen_deep(gen, scale):
+    # deep nesting with few files on every level
+    depth = max(2, int(48 * scale))
+    path = STR_SLASH.join(['level%02d' % i for i in range(depth)])
+    for level in range(depth):
+        rel_dir = STR_SLASH + STR_SLASH.join(path.split(STR_SLASH)[:level + 1])
+        for i in range(4):
+            gen.write(rel_dir + '/file%d.dat' % i, gen.content(gen.Rnd.randint(0, 16384)))
+
+
+def gen_dup(gen, scale):
+    # duplicate-heavy content: many files share few distinct contents
+    count = max(1, int(3000 * scale))
+    blobs = [gen.content(gen.Rnd.randint(1024, 65536)) for i in range(40)]
+    for i in range(count):
+        gen.write('/dup%02d/copy%05d.bin' % (i % 16, i), gen.Rnd.choice(blobs))
+
+
+def gen_mixed(gen, scale):
+    # base tree for incremental change sets
+    count = max(1, int(1500 * scale))
+    for i in range(count):
+        size = gen.Rnd.choice([0, 100, 2000, 30000, 300000])
+        gen.write('/p%02d/s%02d/m%05d.dat' % (i % 12, i % 7, i), gen.content(size))
+
+
+def apply_change_set(gen, percent):
+    # modify / touch / delete / add `percent` % of files each
+    paths = list(gen.Paths)
+    gen.Rnd.shuffle(paths)
+    n = max(1, len(paths) * percent // 100)
+    changed = {'modified': 0, 'touched': 0, 'deleted': 0, 'added': 0}
+    for rel_path in paths[:n]:
+        size = os.path.getsize(gen.Root + rel_path)
+        with open(gen.Root + rel_path, 'wb') as f:
+            f.write(gen.content(size))
+        os.utime(gen.Root + rel_path, (BASE_MTIME + 3600, BASE_MTIME + 3600))
+        changed['modified'] += 1
+    for rel_path in paths[n:2*n]:
+        os.utime(gen.Root + rel_path, (BASE_MTIME + 7200, BASE_MTIME + 7200))
+        changed['touched'] += 1
+    for rel_path in paths[2*n:3*n]:
+        os.remove(gen.Root + rel_path)
+        gen.Paths.remove(rel_path)
+        changed['deleted'] += 1
+    for i in range(n):
+        gen.write('/new/n%05d.dat' % i, gen.content(gen.Rnd.randint(0, 65536)), BASE_MTIME + 3600)
+        changed['added'] += 1
+    return changed
+
+
+# name: (generator, volume size, include incremental change set)
+SCENARIOS = {
+    'small': (gen_small, 64*MB, False),
+    'huge': (gen_huge, 20*MB, False),
+    'deep': (gen_deep, 64*MB, False),
+    'dup': (gen_dup, 64*MB, False),
+    'incremental': (gen_mixed, 64*MB, True),
+}
+
+
+# ------------------------------------------------------------------------------
+# child process side
+# ------------------------------------------------------------------------------
+
+# python level counters of file system calls made by siddar
+COUNTED_OS_CALLS = ['stat', 'lstat', 'listdir', 'scandir', 'utime', 'remove', 'makedirs', 'open']
+
+
+def install_os_counters(counters):
+    def wrap(module, name, key):
+        func = getattr(module, name)
+
+        def counted(*a, **kw):
+            counters[key] = counters.get(key, 0) + 1
+            return func(*a, **kw)
+        setattr(module, name, counted)
+
+    import builtins
+    for name in COUNTED_OS_CALLS:
+        if name == 'open':
+            wrap(builtins, 'open', 'open')
+        elif hasattr(os, name):
+            wrap(os, name, name)
+
+
+def read_proc_io():
+    # Linux only: read/write syscall counters and byte counters of this process
+    try:
+        with open('/proc/self/io') as f:
+            result = {}
+            for line in f:
+                key, value = line.split(':')
+                result[key.strip()] = int(value)
+            return result
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def read_peak_rss():
+    # Linux only: ru_maxrss survives exec (it would report the parent's peak), VmHWM does not
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except (IOError, OSError, ValueError):
+        pass
+    return None
+
+
+def child_usage():
+    try:
+        import resource
+    except ImportError:
+        return {'peak_rss_kb': read_peak_rss()}
+    r = resource.getrusage(resource.RUSAGE_SELF)
+    peak = read_peak_rss()
+    if peak is None:
+        peak = r.ru_maxrss
+        if sys.platform == 'darwin':
+            peak //= 1024  # bytes on macOS, kilobytes elsewhere
+    return {'cpu_user': r.ru_utime, 'cpu_sys': r.ru_stime, 'peak_rss_kb': peak,
+            'blocks_in': r.ru_inblock, 'blocks_out': r.ru_oublock,
+            'ctx_voluntary': r.ru_nvcsw, 'ctx_involuntary': r.ru_nivcsw}
+
+
+def core_calc_hash(siddar, work):
+    total = 0
+    for rel_path in work['files']:
+        siddar.calc_hash(work['source'] + rel_path)
+        total += os.path.getsize(work['source'] + rel_path)
+    return {'bytes': total, 'files': len(work['files'])}
+
+
+def core_file_list(siddar, work):
+    lst = siddar.FileList()
+    lst.read_dir_list(work['source'])
+    return {'files': len(lst.dict)}
+
+
+def core_include_exclude(siddar, work):
+    lst = siddar.FileList()
+    lst.read_dir_list(work['source'])
+    n = len(lst.dict)
+    lst.include_hierarchy(['*.txt', '*/d01/*', '*/d02/*'])
+    lst.exclude(['*5.txt', '*/d02/*'])
+    return {'files': n}
+
+
+def core_catalog_io(siddar, work):
+    lst = siddar.FileList()
+    lst.read_dir_list(work['source'])
+    for key in lst.dict:
+        lst.dict[key].mtime = BASE_MTIME
+        if not lst.dict[key].isDir:
+            lst.dict[key].size = 0
+            lst.dict[key].hash = '0' * 64
+    cat_path = work['repository'] + '/core.cat'
+    with open(cat_path, mode='w', encoding='utf-8') as f:
+        lst.save(f)
+    lst.load_file(cat_path)
+    return {'files': len(lst.dict), 'bytes': os.path.getsize(cat_path)}
+
+
+def core_tar_writer(siddar, work):
+    writer = siddar.TarFileWriter(work['repository'] + '/core', work['size'], work['compression'])
+    total = 0
+    try:
+        for i, rel_path in enumerate(work['files']):
+            writer.add(work['source'] + rel_path, 'member%06d' % i)
+            total += os.path.getsize(work['source'] + rel_path)
+    finally:
+        writer.close()
+    return {'bytes': total, 'files': len(work['files']), 'volumes': writer.PartNumber}
+
+
+def core_tar_reader(siddar, work):
+    reader = siddar.TarFileReader(work['repository'] + '/core')
+    total = 0
+    target = work['repository'] + '/extracted.tmp'
+    try:
+        for i, rel_path in enumerate(work['files']):
+            reader.extract('member%06d' % i, target)
+            total += os.path.getsize(target)
+    finally:
+        reader.close()
+    os.remove(target)
+    return {'bytes': total, 'files': len(work['files'])}
+
+
+CORE_BENCHMARKS = {
+    'calc_hash': core_calc_hash,
+    'FileList.read_dir_list': core_file_list,
+    'FileList.include_exclude': core_include_exclude,
+    'FileList.save_load': core_catalog_io,
+    'TarFileWriter.add': core_tar_writer,
+    'TarFileReader.extract': core_tar_reader,
+}
+
+
+def run_child(task_file, result_file):
+    with open(task_file, encoding='utf-8') as f:
+        task = json.load(f)
+    siddar_path = task['siddar']
+    counters = {}
+    result = {}
+    io_before = read_proc_io()
+    if task['kind'] == 'command':
+        siddar = load_siddar(siddar_path)
+        sh_args = siddar.parser.parse_args(task['argv'])
+        stats_file = result_file + '.stats'
+        if hasattr(sh_args, 'stats'):
+            # per-phase breakdown reported by siddar itself
+            sh_args.stats = 'json'
+            sh_args.stats_file = stats_file
+        install_os_counters(counters)
+        start = time.perf_counter()
+        if hasattr(siddar, 'run_command'):
+            siddar.run_command(sh_args)
+        else:
+            sh_args.func(sh_args)
+        result['wall'] = time.perf_counter() - start
+        if os.path.isfile(stats_file):
+            with open(stats_file, encoding='utf-8') as f:
+                result['siddar_stats'] = json.load(f)
+            os.remove(stats_file)
+    else:
+        siddar = load_siddar(siddar_path)
+        install_os_counters(counters)
+        start = time.perf_counter()
+        result.update(CORE_BENCHMARKS[task['kind']](siddar, task['work']))
+        result['wall'] = time.perf_counter() - start
+    io_after = read_proc_io()
+    result.update(child_usage())
+    result['os_calls'] = counters
+    if (io_before is not None) and (io_after is not None):
+        result['syscalls'] = {'read': io_after['syscr'] - io_before['syscr'],
+                              'write': io_after['syscw'] - io_before['syscw']}
+        result['io_bytes'] = {'read': io_after['rchar'] - io_before['rchar'],
+                              'write': io_after['wchar'] - io_before['wchar']}
+    with open(result_file, mode='w', encoding='utf-8') as f:
+        json.dump(result, f)
+
+
+# ------------------------------------------------------------------------------
+# parent process side
+# ------------------------------------------------------------------------------
+
+class Runner:
+    def __init__(self, siddar_path, work_dir, verbose, commands):
+        self.Siddar = siddar_path
+        self.WorkDir = work_dir
+        self.Verbose = verbose
+        self.Commands = commands  # subcommands of benchmarked siddar.py
+        self.Counter = 0
+
+    def run(self, kind, argv=None, work=None):
+        self.Counter += 1
+        task_file = os.path.join(self.WorkDir, 'task%d.json' % self.Counter)
+        result_file = os.path.join(self.WorkDir, 'result%d.json' % self.Counter)
+        with open(task_file, mode='w', encoding='utf-8') as f:
+            json.dump({'siddar': self.Siddar, 'kind': kind, 'argv': argv, 'work': work}, f)
+        start = time.perf_counter()
+        subprocess.run([sys.executable, os.path.abspath(__file__), 'child', task_file, result_file],
+                       stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, check=True)
+        wall = time.perf_counter() - start
+        with open(result_file, encoding='utf-8') as f:
+            result = json.load(f)
+        os.remove(task_file)
+        os.remove(result_file)
+        result['process_wall'] = wall
+        return result
+
+
+def siddar_commands(siddar):
+    # older siddar.py has no verify, cat, diff, prune, compact
+    for action in siddar.parser._actions:
+        if isinstance(action, argparse._SubParsersAction):
+            return sorted(action.choices)
+    return []
+
+
+def add_rates(result, data_bytes, files):
+    wall = result['wall']
+    if wall > 0:
+        result['throughput_mb_s'] = data_bytes / MB / wall
+        result['files_per_s'] = files / wall
+    return result
+
+
+def dir_size(path):
+    total = 0
+    for d, dirs, files in os.walk(path):
+        for f in files:
+            total += os.path.getsize(os.path.join(d, f))
+    return total
+
+
+def run_scenario(runner, name, work_dir, seed, scale, compression):
+    generator, volume_size, incremental = SCENARIOS[name]
+    source = os.path.join(work_dir, name, 'source')
+    repository = os.path.join(work_dir, name, 'repository')
+    destination = os.path.join(work_dir, name, 'destination')
+    for d in (source, repository, destination):
+        os.makedirs(d)
+    phases = []
+
+    start = time.perf_counter()
+    gen = TreeGenerator(source, seed)
+    generator(gen, scale)
+    gen.fix_dir_times()
+    phases.append({'name': 'generate', 'wall': time.perf_counter() - start})
+    tree = gen.info()
+
+    def phase(phase_name, argv, data_bytes, files):
+        if argv[0] not in runner.Commands:
+            return None
+        if runner.Verbose:
+            sys.stderr.write('  %s / %s\n' % (name, phase_name))
+        result = runner.run('command', argv)
+        result['name'] = phase_name
+        phases.append(add_rates(result, data_bytes, files))
+        return result
+
+    common = ['-q', '-g', '-s', str(volume_size), '-c', compression]
+    phase('create', ['create', source, repository, 'full'] + common, tree['bytes'], tree['files'])
+    phases[-1]['repository_bytes'] = dir_size(repository)
+    last = 'full'
+    changed = None
+    if incremental:
+        start = time.perf_counter()
+        changed = apply_change_set(gen, 5)
+        phases.append({'name': 'change_set', 'wall': time.perf_counter() - start, 'changed': changed})
+        phase('create_incremental', ['create', source, repository, 'incr', '-r', 'full'] + common,
+              gen.Bytes, gen.Files)
+        phases[-1]['repository_bytes'] = dir_size(repository)
+        last = 'incr'
+    phase('find', ['find', repository, '*', '-i', '*0.*'], 0, gen.Files)
+    phase('restore', ['restore', repository, last, destination, '-g'], gen.Bytes, gen.Files)
+    phase('verify', ['verify', repository, last, '-q'], dir_size(repository), gen.Files)
+    # largest file, split over volumes in huge
+    cat_path = max(gen.Paths, key=lambda p: os.path.getsize(source + p))
+    phase('cat', ['cat', repository, last, cat_path], os.path.getsize(source + cat_path), 1)
+    phase('diff', ['diff', repository, 'full', last, '-s'], 0, gen.Files)
+    # destructive phases last: full backup is removed, then volumes with few live objects are rewritten
+    phase('prune', ['prune', repository, 'full', '-q'], dir_size(repository), tree['files'])
+    phase('compact', ['compact', repository, '-q', '-s', str(volume_size)], dir_size(repository), 0)
+
+    shutil.rmtree(os.path.join(work_dir, name))
+    return {'tree': tree, 'volume_size': volume_size, 'changed': changed, 'phases': phases}
+
+
+def run_core(runner, work_dir, seed, scale, compression):
+    source = os.path.join(work_dir, 'core', 'source')
+    repository = os.path.join(work_dir, 'core', 'repository')
+    os.makedirs(source)
+    os.makedirs(repository)
+    gen = TreeGenerator(source, seed)
+    gen_small(gen, scale)
+    gen_huge(gen, scale / 4)
+    small = [p for p in gen.Paths if not p.startswith('/huge/')]
+    huge = [p for p in gen.Paths if p.startswith('/huge/')]
+    results = {}
+    work = {'source': source, 'repository': repository, 'size': 20*MB, 'compression': compression}
+    for name, files in (('calc_hash', huge), ('FileList.read_dir_list', []),
+                        ('FileList.include_exclude', []), ('FileList.save_load', []),
+                        ('TarFileWriter.add', small + huge), ('TarFileReader.extract', small[:200] + huge)):
+        if runner.Verbose:
+            sys.stderr.write('  core / %s\n' % name)
+        work['files'] = files
+        result = runner.run(name, work=work)
+        results[name] = add_rates(result, result.get('bytes', 0), result.get('files', 0))
+    shutil.rmtree(os.path.join(work_dir, 'core'))
+    return results
+
+
+def sh_run(sh_args):
+    siddar_path = os.path.abspath(sh_args.siddar)
+    siddar = load_siddar(siddar_path)
+    version = siddar.parser.description
+    scenarios = sh_args.scenario if sh_args.scenario else list(SCENARIOS)
+    for name in scenarios:
+        if name not in SCENARIOS:
+            print('ERROR: Unknown scenario: ' + name)
+            return
+    work_dir = tempfile.mkdtemp(prefix='siddar_bench_', dir=sh_args.work)
+    try:
+        runner = Runner(siddar_path, work_dir, not sh_args.quiet, siddar_commands(siddar))
+        report = {'siddar': siddar_path, 'version': version,
+                  'python': platform.python_version(), 'platform': platform.platform(),
+                  'commands': runner.Commands, 'seed': sh_args.seed, 'scale': sh_args.scale, 'compression': sh_args.compression,
+                  'time': int(time.time()), 'scenarios': {}, 'core': {}}
+        for name in scenarios:
+            report['scenarios'][name] = run_scenario(runner, name, work_dir, sh_args.seed,
+                                                     sh_args.scale, sh_args.compression)
+        if not sh_args.no_core:
+            report['core'] = run_core(runner, work_dir, sh_args.seed, sh_args.scale, sh_args.compression)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    if sh_args.output is None:
+        json.dump(report, sys.stdout, indent=1, sort_keys=True)
+        sys.stdout.write(STR_EOL)
+    else:
+        with open(sh_args.output, mode='w', encoding='utf-8') as f:
+            json.dump(report, f, indent=1, sort_keys=True)
+
+
+def flat_results(report):
+    # (scenario/phase or core/name) -> result
+    result = {}
+    for name, scenario in report['scenarios'].items():
+        for phase in scenario['phases']:
+            result[name + STR_SLASH + phase['name']] = phase
+    for name, core in report['core'].items():
+        result['core' + STR_SLASH + name] = core
+    return result
+
+
+def sh_compare(sh_args):
+    with open(sh_args.old, encoding='utf-8') as f:
+        old = flat_results(json.load(f))
+    with open(sh_args.new, encoding='utf-8') as f:
+        new = flat_results(json.load(f))
+    print('%-40s %10s %10s %8s %10s %10s' % ('benchmark', 'old s', 'new s', 'ratio', 'old RSS', 'new RSS'))
+    for key in sorted(set(old) & set(new)):
+        if ('wall' not in old[key]) or ('wall' not in new[key]):
+            continue
+        ratio = new[key]['wall'] / old[key]['wall'] if old[key]['wall'] > 0 else 0.0
+        print('%-40s %10.3f %10.3f %8.2f %10s %10s' % (key, old[key]['wall'], new[key]['wall'], ratio,
+                                                      old[key].get('peak_rss_kb', '-'),
+                                                      new[key].get('peak_rss_kb', '-')))
+
+
+parser = argparse.ArgumentParser(description='siddar benchmark suite')
+subparsers = parser.add_subparsers()
+
+parser_run = subparsers.add_parser('run')
+parser_run.add_argument('-o', '--output', help='JSON report file. Default: stdout.')
+parser_run.add_argument('-w', '--work', help='Directory for generated trees and repositories. Default: system temp.')
+parser_run.add_argument('-p', '--siddar', default=SIDDAR_PATH, help='siddar.py to benchmark.')
+parser_run.add_argument('-t', '--scenario', nargs='*',
+                        help='Scenarios to run: ' + ', '.join(SCENARIOS) + '. Default: all.')
+parser_run.add_argument('-x', '--scale', type=float, default=1.0, help='Tree size multiplier.')
+parser_run.add_argument('-r', '--seed', type=int, default=2015, help='Random seed for tree generation.')
+parser_run.add_argument('-c', '--compression', default='tar', help="'tar'-default, 'gz' or 'bz2'")
+parser_run.add_argument('-n', '--no-core', action='store_true', help="Don't run core class benchmarks.")
+parser_run.add_argument('-q', '--quiet', action='store_true', help='No progress messages.')
+parser_run.set_defaults(func=sh_run)
+
+parser_compare = subparsers.add_parser('compare')
+parser_compare.add_argument('old', help='JSON report of the old version.')
+parser_compare.add_argument('new', help='JSON report of the new version.')
+parser_compare.set_defaults(func=sh_compare)
+
+if __name__ == '__main__':
+    if (len(sys.argv) == 4) and (sys.argv[1] == 'child'):
+        run_child(sys.argv[2], sys.argv[3])
+    else:
+        args = parser.parse_args()
+        args.func(args)